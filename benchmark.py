@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2024 Johan Kanflo (github.com/kanflo)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+#
+# Micro benchmarks for the hot paths of flighttracker.py. Run with a recorded
+# SBS1 corpus (one message per line) for numbers that mean something:
+#
+#   % ./benchmark.py sbs1 adsbhub-capture.txt
+#
+# Without a corpus a small built-in sample is used.
+#
+
+from typing import *
+import sys
+import time
+import argparse
+import sbs1
+
+# A few lines of the kind the adsbhub feed produces (types 1, 3 and 4)
+SAMPLE_CORPUS = [
+    "MSG,1,1,1,4CA7B5,1,2024/03/01,12:00:00.123,2024/03/01,12:00:00.125,RYR4TX  ,,,,,,,,,,,0",
+    "MSG,3,1,1,4CA7B5,1,2024/03/01,12:00:00.456,2024/03/01,12:00:00.458,,36000,,,55.61234,13.01234,,,0,0,0,0",
+    "MSG,4,1,1,4CA7B5,1,2024/03/01,12:00:00.789,2024/03/01,12:00:00.791,,,452,183,,,-64,,0,0,0,0",
+    "MSG,3,1,1,4787B0,1,2024/03/01,12:00:01.012,2024/03/01,12:00:01.014,,17500,,,55.29126,13.33108,,,0,0,0,0",
+    "MSG,4,1,1,4787B0,1,2024/03/01,12:00:01.345,2024/03/01,12:00:01.347,,,413,131,,,2240,,0,0,0,0",
+]
+
+
+def load_corpus(path: str|None) -> List[str]:
+    """Load an SBS1 corpus, one message per line
+
+    Args:
+        path (str|None): Path to corpus or None for the built-in sample
+
+    Returns:
+        List[str]: The messages
+    """
+    if path is None:
+        return SAMPLE_CORPUS * 2000
+    with open(path, "r", errors="replace") as f:
+        return [line.rstrip("\r\n") for line in f if line.strip()]
+
+
+def measure(func: Callable, corpus: List[str], rounds: int) -> float:
+    """Run func on each message of the corpus and return messages per second
+    for the best of the given number of rounds
+    """
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for line in corpus:
+            func(line)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return len(corpus) / best
+
+
+def bench_sbs1(args: argparse.Namespace):
+    """Compare sbs1.parse with and without the fixed layout date parser"""
+    corpus = load_corpus(args.corpus)
+    print("Parsing %d messages, best of %d rounds" % (len(corpus), args.rounds))
+    fast_parser = getattr(sbs1, "__fastParseDateTime")
+    setattr(sbs1, "__fastParseDateTime", lambda date, time: None)
+    try:
+        before = measure(sbs1.parse, corpus, args.rounds)
+    finally:
+        setattr(sbs1, "__fastParseDateTime", fast_parser)
+    after = measure(sbs1.parse, corpus, args.rounds)
+
+    def lazy_parse(line: str):
+        # Read what Observation.update() reads, the fields the message type carries
+        m = sbs1.parse(line, lazy=True)
+        if m:
+            for field in sbs1.TRANSMISSION_FIELDS.get(m.transmissionType, ()):
+                m[field]
+
+    lazy = measure(lazy_parse, corpus, args.rounds)
+    # Feed parse_batch chunks of 1000 lines
+    chunks = [("\r\n".join(corpus[i:i + 1000]) + "\r\n").encode() for i in range(0, len(corpus), 1000)]
+    batch = measure(sbs1.parse_batch, chunks, args.rounds) * len(corpus) / len(chunks)
+    print("  dateutil         : %10.0f msgs/s" % (before))
+    print("  fixed layout     : %10.0f msgs/s (%.1fx)" % (after, after / before))
+    print("  lazy record      : %10.0f msgs/s (%.1fx)" % (lazy, lazy / before))
+    print("  batch            : %10.0f msgs/s (%.1fx)" % (batch, batch / before))
+
+
+def bench_observation(args: argparse.Namespace):
+    """Measure Observation.update and FlightTracker.handleMessage throughput, without plane database lookups"""
+    import flighttracker
+    flighttracker.args = argparse.Namespace(pdb_host=None, snapshot=None)
+    corpus = load_corpus(args.corpus)
+    messages = [m for m in (sbs1.parse(line, lazy=True) for line in corpus) if m and m["icao24"]]
+    observations = {}
+    for m in messages:
+        if m["icao24"] not in observations:
+            observations[m["icao24"]] = flighttracker.Observation(m)
+    print("Updating %d observations with %d messages, best of %d rounds" % (len(observations), len(messages), args.rounds))
+    rate = measure(lambda m: observations[m["icao24"]].update(m), messages, args.rounds)
+    print("  update()         : %10.0f msgs/s" % (rate))
+    # Parsing, dedup, expiry, the spatial index and tracking too
+    tracker = flighttracker.FlightTracker("localhost", "localhost", 55.6, 13.0, "/benchmark", dedup_window = 0)
+    rate = measure(tracker.handleMessage, corpus, args.rounds)
+    print("  handleMessage()  : %10.0f msgs/s" % (rate))
+
+
+def bench_spatial(args: argparse.Namespace):
+    """Compare nearest aircraft lookups in the spatial index with a linear scan"""
+    import random
+    import utils
+    from spatial import SpatialIndex
+    random.seed(1)
+    (home_lat, home_lon) = (55.6, 13.0)
+    for count in args.aircraft:
+        # A global feed, a third of the aircraft within a few hundred km
+        positions = {}
+        for i in range(count):
+            if i % 3:
+                positions["%06X" % i] = (random.uniform(-70, 70), random.uniform(-180, 180))
+            else:
+                positions["%06X" % i] = (random.uniform(52, 59), random.uniform(6, 20))
+        keys = list(positions)
+        index = SpatialIndex()
+        rate = measure(lambda key: index.update(key, *positions[key]), keys, args.rounds)
+        observers = [(home_lat + random.uniform(-2, 2), home_lon + random.uniform(-2, 2)) for _ in range(100)]
+
+        def scan(observer: Tuple[float, float]):
+            best = None
+            best_distance = 999999999
+            for (key, (lat, lon)) in positions.items():
+                distance = utils.coordinate_distance(observer[0], observer[1], lat, lon)
+                if distance < best_distance:
+                    (best, best_distance) = (key, distance)
+            return best
+
+        print("%d aircraft, best of %d rounds" % (count, args.rounds))
+        print("  update()         : %10.0f updates/s" % (rate))
+        print("  linear scan      : %10.1f queries/s" % (measure(scan, observers, args.rounds)))
+        print("  nearest()        : %10.1f queries/s" % (measure(lambda observer: index.nearest(*observer), observers, args.rounds)))
+        print("  within(50 km)    : %10.1f queries/s" % (measure(lambda observer: index.within(observer[0], observer[1], 50000), observers, args.rounds)))
+
+
+def proximity_reports(count: int) -> List[Tuple]:
+    """Return the arguments of count proximity reports of an aircraft flying by"""
+    import json
+    import flighttracker
+    airport = {"iata": "MMX", "icao": "ESMS", "name": "Malmö Sturup", "lat": 55.53, "lon": 13.37}
+    route = {"origin": airport, "destination": dict(airport, iata = "ORD", name = "O'Hare International")}
+    snapshot = flighttracker.ObservationSnapshot("4787B0", "SAS123", 17500, 413, 131, 55.29126, 13.33108, 2240, 0, time.time(),
+                                                 "Scandinavian Airlines", "SE-RJX", "Airbus A320 251N", route, json.dumps(route),
+                                                 "https://cdn.jetphotos.com/full/5/12345_1234567890.jpg")
+    # The dead reckoned position changes on every report, the rest does not
+    return [(snapshot._replace(lat = snapshot.lat + i * 1e-4), 45 + i % 90, 8400 + i * 100, time.time(), i) for i in range(count)]
+
+
+def bench_json(args: argparse.Namespace):
+    """Compare serializing proximity reports with json.dumps and with the cached serializer"""
+    import json
+    from proximity import JSONSerializer, proximity_payload
+    reports = proximity_reports(1000)
+    serializer = JSONSerializer()
+    assert all(serializer.json(*report) == json.dumps(proximity_payload(*report)) for report in reports)
+    print("%d bytes per report, best of %d rounds" % (len(serializer.json(*reports[0])), args.rounds))
+    before = measure(lambda report: json.dumps(proximity_payload(*report)), reports, args.rounds)
+    after = measure(lambda report: serializer.json(*report), reports, args.rounds)
+    print("  json.dumps       : %10.0f reports/s" % (before))
+    print("  JSONSerializer   : %10.0f reports/s (%.1fx)" % (after, after / before))
+
+
+def bench_binary(args: argparse.Namespace):
+    """Compare the size and speed of JSON, JSON delta and binary proximity reports"""
+    import json
+    from proximity import JSONSerializer, BinaryEncoder, DeltaEncoder, decode_binary
+    reports = proximity_reports(1000)
+    serializer = JSONSerializer()
+    encoder = BinaryEncoder()
+    strings = {}
+    for report in reports:
+        strings.update(encoder.encode(*report)[1])
+    encoded = [(serializer.json(*report), encoder.encode(*report)[0]) for report in reports]
+    (text, payload) = encoded[0]
+    print("Best of %d rounds" % (args.rounds))
+    print("  JSON             : %10d bytes" % (len(text)))
+    delta = DeltaEncoder()
+    sizes = [len(delta.encode(*report)) for report in reports]
+    print("  JSON delta       : %10.0f bytes on average, %d keyframes" % (sum(sizes) / len(sizes), delta.keyframes))
+    print("  binary           : %10d bytes + %d bytes of strings sent once" % (len(payload), sum(len(string.encode("utf-8")) for string in strings.values())))
+    print("  JSON encode      : %10.0f reports/s" % (measure(lambda report: serializer.json(*report), reports, args.rounds)))
+    print("  binary encode    : %10.0f reports/s" % (measure(lambda report: encoder.encode(*report), reports, args.rounds)))
+    print("  JSON decode      : %10.0f reports/s" % (measure(lambda item: json.loads(item[0]), encoded, args.rounds)))
+    print("  binary decode    : %10.0f reports/s" % (measure(lambda item: decode_binary(item[1], strings), encoded, args.rounds)))
+
+
+def bench_stress(args: argparse.Namespace):
+    """Run ingest and publishing concurrently at full speed and check that
+    every report is of one consistent aircraft state"""
+    import json
+    import threading
+    import flighttracker
+    flighttracker.args = argparse.Namespace(pdb_host=None, snapshot=None)
+    # Publish as fast as possible
+    flighttracker.PUBLISH_MIN_INTERVAL = flighttracker.PUBLISH_MAX_INTERVAL = 0
+    errors = []
+    threading.excepthook = lambda hook_args: errors.append(repr(hook_args.exc_value))
+
+    class Sink(object):
+        """Stands in for the MQTT client, checks every report"""
+        def __init__(self):
+            self.client = self
+            self.reports = 0
+            self.torn = 0
+
+        def publish(self, topic: str, payload: str, qos: int, retain: bool):
+            report = json.loads(payload)
+            self.reports += 1
+            # Each message moves an aircraft north and climbs it in step, and its longitude is given by its icao24
+            step = report["altitude"] - 10000
+            if round((report["lat"] - 55.5) * 1e5) != step or abs(report["lon"] - (13 + (int(report["icao24"], 16) - 1) / 1000)) > 1e-5:
+                self.torn += 1
+
+    tracker = flighttracker.FlightTracker("localhost", "localhost", 55.6, 13.0, "/stress", observation_timeout = 0.5)
+    sink = Sink()
+    tracker.startPublishing(sink)
+    messages = 0
+    start = time.monotonic()
+    step = 0
+    while time.monotonic() - start < args.duration:
+        step += 1
+        # Aircraft come and go so that the tracked one keeps changing
+        first = (step // 2000) % args.aircraft
+        for i in range(first, first + args.aircraft // 2):
+            icao24 = "%06X" % (i + 1)
+            n = step % 10000
+            tracker.handleMessage("MSG,3,1,1,%s,1,,,,,,%d,,,%.5f,%.5f,,,0,0,0,0" % (icao24, 10000 + n, 55.5 + n / 1e5, 13 + i / 1000))
+            tracker.handleMessage("MSG,4,1,1,%s,1,,,,,,,%d,%d,,,-64,,0,0,0,0" % (icao24, 200 + i % 300, (step + i) % 360))
+            observation = tracker.getObservation(icao24)
+            if observation.getImageUrl() is None:
+                observation.setImageUrl("http://example.com/%s.jpg" % (icao24))
+            messages += 2
+    elapsed = time.monotonic() - start
+    print("%d aircraft for %.0f seconds" % (args.aircraft, elapsed))
+    print("  ingest           : %10.0f msgs/s" % (messages / elapsed))
+    print("  publish          : %10.0f reports/s" % (sink.reports / elapsed))
+    print("  torn reports     : %10d" % (sink.torn))
+    print("  thread errors    : %10d %s" % (len(errors), "; ".join(errors[:3])))
+    if sink.torn or errors or not sink.reports:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ADS-B funhouse micro benchmarks')
+    parser.add_argument('-r', '--rounds', type=int, help="Number of rounds, best is reported (default 3)", default=3)
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    p = subparsers.add_parser('sbs1', help="SBS1 parser throughput")
+    p.add_argument('corpus', nargs='?', help="Recorded SBS1 corpus, one message per line")
+    p.set_defaults(func=bench_sbs1)
+
+    p = subparsers.add_parser('observation', help="Observation.update and FlightTracker.handleMessage throughput")
+    p.add_argument('corpus', nargs='?', help="Recorded SBS1 corpus, one message per line")
+    p.set_defaults(func=bench_observation)
+
+    p = subparsers.add_parser('spatial', help="Nearest aircraft lookup, spatial index vs linear scan")
+    p.add_argument('aircraft', nargs='*', type=int, help="Number of aircraft (default 1000 10000 50000)", default=[1000, 10000, 50000])
+    p.set_defaults(func=bench_spatial)
+
+    p = subparsers.add_parser('json', help="Proximity report serialization, json.dumps vs cached serializer")
+    p.set_defaults(func=bench_json)
+
+    p = subparsers.add_parser('binary', help="Size and speed of JSON, JSON delta and binary proximity reports")
+    p.set_defaults(func=bench_binary)
+
+    p = subparsers.add_parser('stress', help="Ingest and publish concurrently, check for torn reads")
+    p.add_argument('-d', '--duration', type=float, help="Seconds to run (default 10)", default=10)
+    p.add_argument('-a', '--aircraft', type=int, help="Number of aircraft (default 200)", default=200)
+    p.set_defaults(func=bench_stress)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
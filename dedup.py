@@ -0,0 +1,98 @@
+#
+# Copyright (c) 2024 Johan Kanflo (github.com/kanflo)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+#
+# Drop SBS1 messages already received from another feed. With a couple of
+# receivers and the adsbhub feed the same report arrives several times.
+#
+
+from typing import *
+import time
+import sbs1
+
+# Messages with the same content within this many seconds are duplicates
+DEDUP_WINDOW = 2.0
+# Rotate early if a generation grows beyond this many messages
+DEDUP_MAX_ENTRIES = 100000
+
+
+class DedupFilter(object):
+    """
+    Time windowed duplicate filter. Message hashes are kept in two
+    generations of sets, the older one is thrown away when the current
+    one is a window old (or full), which keeps memory bounded.
+    """
+
+    def __init__(self, window: float = DEDUP_WINDOW, max_entries: int = DEDUP_MAX_ENTRIES):
+        """Create a duplicate filter
+
+        Keyword Arguments:
+            window {float} -- Seconds during which a repeated message is a duplicate (default: {DEDUP_WINDOW})
+            max_entries {int} -- Max number of messages in each generation (default: {DEDUP_MAX_ENTRIES})
+        """
+        self.__window = window
+        self.__max_entries = max_entries
+        self.__current = set()
+        self.__previous = set()
+        self.__rotate_time = time.monotonic() + window
+        self.messages = 0
+        self.dropped = 0
+
+    def isDuplicate(self, msg: sbs1.SBS1Message, now: float = None) -> bool:
+        """Check if the message was seen recently. The message is remembered if it was not.
+
+        Arguments:
+            msg {sbs1.SBS1Message} -- Parsed SBS1 message
+
+        Keyword Arguments:
+            now {float} -- time.monotonic() of the message (default: {None})
+
+        Returns:
+            bool -- True if the message is a duplicate that should be dropped
+        """
+        if now is None:
+            now = time.monotonic()
+        if now >= self.__rotate_time or len(self.__current) >= self.__max_entries:
+            self.__rotate(now)
+        key = hash((msg["icao24"], msg["transmissionType"]) + tuple(msg[field] for field in sbs1.TRANSMISSION_FIELDS.get(msg["transmissionType"], ())))
+        self.messages += 1
+        if key in self.__current or key in self.__previous:
+            self.dropped += 1
+            return True
+        self.__current.add(key)
+        return False
+
+    def getDropRate(self) -> float:
+        """Return the fraction of messages dropped so far
+        """
+        if self.messages == 0:
+            return 0
+        return self.dropped / self.messages
+
+    def __rotate(self, now: float):
+        if now >= self.__rotate_time + self.__window:
+            # Nothing received for a whole window, everything is stale
+            self.__previous = set()
+        else:
+            self.__previous = self.__current
+        self.__current = set()
+        self.__rotate_time = now + self.__window
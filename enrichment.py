@@ -0,0 +1,201 @@
+#
+# Copyright (c) 2024 Johan Kanflo (github.com/kanflo)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+#
+# Worker pool for slow lookups (plane database, image search) so that the
+# ingest loop never waits on the network. Results are collected by the
+# ingest loop with results() and merged into the observations there, so
+# observations are only ever modified by one thread.
+#
+
+from typing import *
+import time
+import queue
+import logging
+import threading
+from collections import deque
+
+# Number of worker threads
+ENRICHMENT_WORKERS = 4
+# Max number of jobs queued or running, further jobs are rejected
+MAX_IN_FLIGHT = 200
+# Collect keys for a batch this many seconds
+BATCH_WINDOW = 0.05
+# Max number of keys in a batch
+BATCH_SIZE = 200
+
+
+class EnrichmentPool(object):
+    """
+    A bounded pool of worker threads running lookup jobs
+    """
+
+    def __init__(self, workers: int = ENRICHMENT_WORKERS, max_in_flight: int = MAX_IN_FLIGHT):
+        """Create the pool and start the workers
+
+        Keyword Arguments:
+            workers {int} -- Number of worker threads (default: {ENRICHMENT_WORKERS})
+            max_in_flight {int} -- Max number of jobs queued or running (default: {MAX_IN_FLIGHT})
+        """
+        self.__jobs = queue.Queue()
+        self.__results = deque()
+        self.__in_flight = set()
+        self.__max_in_flight = max_in_flight
+        self.__lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        for i in range(workers):
+            threading.Thread(target = self.__worker, name = "Enrichment-%d" % (i), daemon = True).start()
+
+    def submit(self, key: Hashable, func: Callable, *args) -> bool:
+        """Run func(*args) on a worker. A job with the same key as one in flight is ignored.
+
+        Arguments:
+            key {Hashable} -- Identifies the job, returned with the result
+            func {Callable} -- Function to run
+
+        Returns:
+            bool -- False if the job was rejected because too many are in flight, try again later
+        """
+        with self.__lock:
+            if key in self.__in_flight:
+                return True
+            if len(self.__in_flight) >= self.__max_in_flight:
+                self.rejected += 1
+                return False
+            self.__in_flight.add(key)
+            self.submitted += 1
+        self.__jobs.put((key, func, args))
+        return True
+
+    def hasResults(self) -> bool:
+        return len(self.__results) > 0
+
+    def results(self) -> Iterator[Tuple[Hashable, Any, Exception|None]]:
+        """Return the results of jobs finished since the last call. A job is
+        in flight until its result has been collected here.
+
+        Yields:
+            Tuple[Hashable, Any, Exception|None] -- Key, result and the exception raised by the job if it failed
+        """
+        while self.__results:
+            (key, result, error) = self.__results.popleft()
+            with self.__lock:
+                self.__in_flight.discard(key)
+            yield (key, result, error)
+
+    def getQueueDepth(self) -> int:
+        """Return the number of jobs waiting for a worker
+        """
+        return self.__jobs.qsize()
+
+    def getInFlight(self) -> int:
+        """Return the number of jobs queued, running or with results not yet collected
+        """
+        return len(self.__in_flight)
+
+    def stats(self) -> str:
+        """Return the pool statistics as a string for logging
+        """
+        return "Enrichment: %d queued, %d in flight, %d submitted, %d completed, %d failed, %d rejected" % \
+            (self.getQueueDepth(), self.getInFlight(), self.submitted, self.completed, self.failed, self.rejected)
+
+    def __worker(self):
+        while True:
+            (key, func, args) = self.__jobs.get()
+            error = None
+            result = None
+            try:
+                result = func(*args)
+            except Exception as e:
+                logging.error("Enrichment job %s failed" % (str(key)), exc_info = True)
+                error = e
+            with self.__lock:
+                if error is None:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+            self.__results.append((key, result, error))
+
+
+class LookupBatcher(object):
+    """
+    Gather keys for a few milliseconds and look them up in one job, eg. the
+    hundreds of aircraft that appear when the tracker starts or a feed
+    reconnects. The result is returned by EnrichmentPool.results() with the
+    key (name, (key, key, ...)).
+    """
+
+    def __init__(self, pool: EnrichmentPool, name: str, func: Callable[[List[Hashable]], Any], window: float = BATCH_WINDOW, max_size: int = BATCH_SIZE):
+        """Create a batcher
+
+        Arguments:
+            pool {EnrichmentPool} -- Pool running the batches
+            name {str} -- Name of the batch jobs
+            func {Callable[[List[Hashable]], Any]} -- Looks up a list of keys
+
+        Keyword Arguments:
+            window {float} -- Seconds to collect keys for after the first one arrived (default: {BATCH_WINDOW})
+            max_size {int} -- Submit the batch when this many keys have been collected (default: {BATCH_SIZE})
+        """
+        self.__pool = pool
+        self.__name = name
+        self.__func = func
+        self.__window = window
+        self.__max_size = max_size
+        self.__pending = []
+        self.__deadline = None
+        self.__keys = set()  # Keys pending or in submitted batches
+        self.batches = 0
+
+    def add(self, key: Hashable):
+        """Add key to the next batch, unless it is already pending
+        """
+        if key in self.__keys:
+            return
+        self.__keys.add(key)
+        if not self.__pending:
+            self.__deadline = time.monotonic() + self.__window
+        self.__pending.append(key)
+        if len(self.__pending) >= self.__max_size:
+            self.poll(force = True)
+
+    def poll(self, force: bool = False):
+        """Submit the pending batch if it is due, call this often
+        """
+        if not self.__pending or (not force and time.monotonic() < self.__deadline):
+            return
+        batch = tuple(self.__pending)
+        if self.__pool.submit((self.__name, batch), self.__func, list(batch)):
+            self.__pending = []
+            self.batches += 1
+        # else the pool is busy, try again on the next poll
+
+    def done(self, keys: Iterable[Hashable]):
+        """Mark the keys of a batch as looked up
+        """
+        self.__keys.difference_update(keys)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.__keys
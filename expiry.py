@@ -0,0 +1,154 @@
+#
+# Copyright (c) 2024 Johan Kanflo (github.com/kanflo)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+#
+# Expiry of keys (eg. aircraft) not seen in a while, driven by a min heap of
+# deadlines so that checking for expired keys costs nothing until one is due.
+#
+# Touching a key only records when it was seen. Its heap entry is left alone
+# and when it comes due it is pushed back with the new deadline, so a key has
+# a single heap entry no matter how often it is seen.
+#
+# Running this file checks the queue against a brute force scan.
+#
+
+from typing import *
+import heapq
+
+# Default seconds until a key not seen expires
+EXPIRY_TIMEOUT = 30
+
+
+class ExpiryQueue(object):
+    """
+    Keys that expire when not touched for a while, all times are time.monotonic()
+    """
+
+    def __init__(self, timeout: float = EXPIRY_TIMEOUT):
+        """Create an empty queue
+
+        Keyword Arguments:
+            timeout {float} -- Seconds until a key not touched expires (default: {EXPIRY_TIMEOUT})
+        """
+        self.__timeout = timeout
+        self.__heap = []  # (deadline, key) for every key, and stale entries of removed keys
+        self.__pushed = {}  # key -> deadline of its current heap entry
+        self.__seen = {}  # key -> time last touched
+        self.__timeouts = {}  # key -> timeout, for keys not using the default
+
+    def touch(self, key: Hashable, now: float):
+        """Record that key was seen now, adding it if needed
+        """
+        if key not in self.__seen:
+            self.__push(key, now + self.__timeouts.get(key, self.__timeout))
+        self.__seen[key] = now
+
+    def setTimeout(self, key: Hashable, timeout: float|None):
+        """Use a timeout of its own for key, None for the default. Takes effect when its current deadline comes due.
+        """
+        if timeout is None:
+            self.__timeouts.pop(key, None)
+        else:
+            self.__timeouts[key] = timeout
+
+    def remove(self, key: Hashable):
+        """Forget key, its heap entry is dropped when it comes due
+        """
+        self.__seen.pop(key, None)
+        self.__pushed.pop(key, None)
+        self.__timeouts.pop(key, None)
+
+    def expired(self, now: float) -> List[Hashable]:
+        """Remove and return the keys that have not been touched within their timeout
+
+        Arguments:
+            now {float} -- Current time
+
+        Returns:
+            List[Hashable] -- The expired keys
+        """
+        heap = self.__heap
+        expired = []
+        while heap and heap[0][0] <= now:
+            (pushed, key) = heapq.heappop(heap)
+            if self.__pushed.get(key) != pushed:
+                # Removed, and maybe added again with an entry of its own
+                continue
+            deadline = self.__seen[key] + self.__timeouts.get(key, self.__timeout)
+            if deadline <= now:
+                self.remove(key)
+                expired.append(key)
+            else:
+                # Seen since it was pushed
+                self.__push(key, deadline)
+        return expired
+
+    def getNextDeadline(self) -> float|None:
+        """Return the earliest time a key may expire, None if empty
+        """
+        return self.__heap[0][0] if self.__heap else None
+
+    def __len__(self) -> int:
+        return len(self.__seen)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.__seen
+
+    def __push(self, key: Hashable, deadline: float):
+        self.__pushed[key] = deadline
+        heapq.heappush(self.__heap, (deadline, key))
+
+
+def _check():
+    """Compare the queue with a brute force scan of last seen times"""
+    import random
+    random.seed(1)
+    queue = ExpiryQueue(10)
+    seen = {}
+    timeouts = {}
+    now = 0.0
+    for step in range(20000):
+        now += random.uniform(0, 0.05)
+        key = random.randint(0, 500)
+        if random.random() < 0.01:
+            queue.remove(key)
+            seen.pop(key, None)
+            timeouts.pop(key, None)
+        else:
+            if key not in seen and random.random() < 0.1:
+                queue.setTimeout(key, 3)
+                timeouts[key] = 3
+            queue.touch(key, now)
+            seen[key] = now
+        expected = sorted(key for (key, t) in seen.items() if t + timeouts.get(key, 10) <= now)
+        assert sorted(queue.expired(now)) == expected, "Step %d" % (step)
+        for key in expected:
+            del seen[key]
+            timeouts.pop(key, None)
+        assert len(queue) == len(seen)
+    # Stale entries do not pile up
+    assert len(queue._ExpiryQueue__heap) <= 2 * 501
+
+
+if __name__ == "__main__":
+    _check()
+    print("All good")
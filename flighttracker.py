@@ -23,6 +23,8 @@
 
 from typing import *
 import socket
+import asyncio
+import signal
 import argparse
 import threading
 import sys
@@ -32,221 +34,427 @@ import logging
 import coloredlogs
 from datetime import datetime, timedelta
 import time
+import math
+import json
+import numpy as np
 import sbs1
+from linereader import LineReader
+from ingest import Feed, IngestEngine, parse_feed
+from dedup import DedupFilter, DEDUP_WINDOW
+from spatial import SpatialIndex
+from expiry import ExpiryQueue
+from obstable import ObservationTable, OBJECT_COLUMNS
+from proximity import JSONSerializer, BinaryEncoder, DeltaEncoder, proximity_payload, KEYFRAME_INTERVAL
+import recorder
+from recorder import Recorder
+from enrichment import EnrichmentPool, LookupBatcher, ENRICHMENT_WORKERS
 from planedb import *
+import planecache
+from planestore import PlaneStore
 import utils
 import mqtt_wrapper
 
 
-# Clean out observations this often
+# Log statistics this often
 OBSERVATION_CLEAN_INTERVAL = 30
+# Forget aircraft not heard from in this many seconds
+OBSERVATION_TIMEOUT = 30
+# Retry a failed plane database lookup after this many seconds
+AIRCRAFT_RETRY_INTERVAL = 60
+# Retry a failed route lookup after this many seconds
+ROUTE_RETRY_INTERVAL = 60
 # Socket read timeout
 DUMP1090_SOCKET_TIMEOUT = 60
+# Max distance error in meters of the distances published, the fastest geodesy mode meeting it is used
+GEODESY_ACCURACY = 10
+# Range in meters the fast geodesy modes are used within, aircraft further away are handled with haversine
+GEODESY_RANGE = 50000
+# When selecting what to track, dead reckon the aircraft last seen this many meters further away than the nearest one
+SELECT_MARGIN = 20000
+# Shortest and longest time in seconds between proximity reports
+PUBLISH_MIN_INTERVAL = 0.25
+PUBLISH_MAX_INTERVAL = 1.0
+# The tracked aircraft is published every distance / PUBLISH_SCALE seconds when not approaching,
+# eg. every 0.25s at 3 km and every 0.5s at 6 km
+PUBLISH_SCALE = 12000
+# An approaching aircraft is published as if it was as much closer as it flies in this many seconds
+PUBLISH_CLOSING_TIME = 20
 
 args = None
 
 counter = 0
 
-# http://stackoverflow.com/questions/1165352/fast-comparison-between-two-python-dictionary
-class DictDiffer(object):
+# Dirty bits for the fields of an observation, set by Observation.update and the set* methods when a value changes
+DIRTY_CALLSIGN = 1 << 1
+DIRTY_ALTITUDE = 1 << 2
+DIRTY_GROUND_SPEED = 1 << 3
+DIRTY_TRACK = 1 << 4
+DIRTY_LAT = 1 << 5
+DIRTY_LON = 1 << 6
+DIRTY_VERTICAL_RATE = 1 << 7
+DIRTY_OPERATOR = 1 << 8
+DIRTY_REGISTRATION = 1 << 9
+DIRTY_TYPE = 1 << 10
+DIRTY_ROUTE = 1 << 11
+DIRTY_IMAGE = 1 << 12
+
+
+def resolve_route(callsign: str) -> Tuple[dict, str]:
+    """Look up the route of a flight and its airports
+
+    Arguments:
+        callsign {str} -- Callsign of the flight
+
+    Returns:
+        Tuple[dict, str] -- {'origin' : airport, 'destination' : airport} or an empty dict if not known, and its JSON representation
     """
-    Calculate the difference between two dictionaries as:
-    (1) items added
-    (2) items removed
-    (3) keys same in both but changed values
-    (4) keys same in both and unchanged values
+    route = planecache.lookup_route(callsign)
+    if not route:
+        return ({}, "{}")
+    src = planecache.airport_index.get(route['src_iata'])
+    dst = planecache.airport_index.get(route['dst_iata'])
+    if not src or not dst:
+        return ({}, "{}")
+    return ({'origin' : src[0], 'destination' : dst[0]}, '{"origin": %s, "destination": %s}' % (src[1], dst[1]))
+
+
+def publish_interval(distance: float, closing_speed: float) -> float:
+    """Return the time until the next proximity report of an aircraft
+
+    Arguments:
+        distance {float} -- Distance to the aircraft in meters
+        closing_speed {float} -- Speed in m/s the aircraft approaches us with, negative when moving away
+
+    Returns:
+        float -- Seconds, between PUBLISH_MIN_INTERVAL and PUBLISH_MAX_INTERVAL
     """
-    def __init__(self, current_dict, past_dict):
-        self.current_dict, self.past_dict = current_dict, past_dict
-        self.set_current, self.set_past = set(current_dict.keys()), set(past_dict.keys())
-        self.intersect = self.set_current.intersection(self.set_past)
+    interval = distance / (PUBLISH_SCALE + PUBLISH_CLOSING_TIME * max(0, closing_speed))
+    return min(PUBLISH_MAX_INTERVAL, max(PUBLISH_MIN_INTERVAL, interval))
+
+
+class ObservationSnapshot(NamedTuple):
+    """
+    The state of an observation at one point in time. Snapshots are never
+    modified, the ingest thread hands them to the publish thread by replacing
+    a reference to one, so the publisher cannot see a half updated aircraft.
+    Numeric fields are NaN if not known, as in the ObservationTable.
+    """
+    icao24: str
+    callsign: str|None
+    altitude: float
+    groundSpeed: float
+    track: float
+    lat: float
+    lon: float
+    verticalRate: float
+    seen: float  # time.monotonic() last heard from
+    date: float  # time.time() last heard from
+    operator: str|None
+    registration: str|None
+    type: str|None
+    route: dict|None
+    route_json: str|None
+    image_url: str|None
+
+    def getLoggedDate(self) -> datetime:
+        return datetime.utcfromtimestamp(self.date)
 
-    def added(self):
-        return self.set_current - self.intersect
+    def json(self, bearing: int, distance: int, serializer: JSONSerializer = None, delta: DeltaEncoder = None) -> str:
+        """Return JSON representation
 
-    def removed(self):
-        return self.set_past - self.intersect
+        Arguments:
+            bearing {int} -- bearing to observation in degrees
+            distance {int} -- distance to observation in meters
 
-    def changed(self):
-        return set(o for o in self.intersect if self.past_dict[o] != self.current_dict[o])
+        Keyword Arguments:
+            serializer {JSONSerializer} -- Serialize with this, reusing what it has serialized of the aircraft before (default: {None})
+            delta {DeltaEncoder} -- Return a keyframe or the fields changed since the report before (default: {None})
 
-    def unchanged(self):
-        return set(o for o in self.intersect if self.past_dict[o] == self.current_dict[o])
+        Returns:
+            str -- JSON string, see proximity.proximity_payload
+        """
+        global counter
+        counter += 1
+        if delta is not None:
+            return delta.encode(self, bearing, distance, time.time(), counter, serializer)
+        if serializer is not None:
+            return serializer.json(self, bearing, distance, time.time(), counter)
+        return json.dumps(proximity_payload(self, bearing, distance, time.time(), counter))
 
 
 class Observation(object):
     """
-    This class keeps track of the observed flights around us.
+    This class keeps track of the observed flights around us. The state lives
+    in an ObservationTable slot, an Observation is a view of it.
     """
-    __icao24 = None
-    __loggedDate = None
-    __callsign = None
-    __altitude = None
-    __altitudeTime = None
-    __groundSpeed = None
-    __track = None
-    __lat = None
-    __lon = None
-    __latLonTime = None
-    __verticalRate = None
-    __operator = None
-    __registration = None
-    __type = None
-    __updated = None
-    __route = None
-    __image_url = None
-    __planedb_nagged = False  # Used in case the icao24 is unknown and we only want to log this once
-    __planedb_unknown = False
-    __planedb_unknown_nagged = False
-
-    def __init__(self, sbs1msg):
+    __slots__ = ("__table", "__slot")
+
+    # Plane database and image search state in the flags column
+    FLAG_PLANEDB_NAGGED = 1 << 0  # Used in case the icao24 is unknown and we only want to log this once
+    FLAG_PLANEDB_UNKNOWN = 1 << 1
+    FLAG_PLANEDB_UNKNOWN_NAGGED = 1 << 2
+    FLAG_PLANEDB_DONE = 1 << 3  # Set when the plane database lookup has finished
+    FLAG_IMAGE_SEARCHED = 1 << 4
+
+    def __init__(self, sbs1msg, table: ObservationTable = None, now: float = None):
+        """Create an observation in a new slot
+
+        Arguments:
+            sbs1msg {sbs1.SBS1Message} -- First message of the aircraft
+
+        Keyword Arguments:
+            table {ObservationTable} -- Table to keep the observation in (default: {observation_table})
+            now {float} -- time.monotonic() of the message (default: {None})
+        """
         logging.info("%s appeared" % sbs1msg["icao24"])
-        self.__icao24 = sbs1msg["icao24"]
-        self.__loggedDate = datetime.utcnow()  # sbs1msg["loggedDate"]
-        self.__callsign = sbs1msg["callsign"]
-        self.__altitude = sbs1msg["altitude"]
-        self.__altitudeTime = datetime.utcnow()
-        self.__groundSpeed = sbs1msg["groundSpeed"]
-        self.__track = sbs1msg["track"]
-        self.__lat = sbs1msg["lat"]
-        self.__lon = sbs1msg["lon"]
-        self.__latLonTime = datetime.utcnow()
-        self.__verticalRate = sbs1msg["verticalRate"]
-        self.__operator = None
-        self.__registration = None
-        self.__type = None
-        self.__updated = True
-        if args.pdb_host:
-            plane = planedb.lookup_aircraft_icao24(self.__icao24)
-            if plane:
-                self.__registration = plane["registration"]
-                self.__type = plane["manufacturer"] + " " + plane["model"]
-                self.__operator = plane["operator"]
-                self.__image_url = plane["image"]
-                if self.__image_url is None or len(self.__image_url) < 2:
-                    self.__image_url = utils.image_search(self.__icao24, self.__operator, self.__type, self.__registration)
-            else:
-                self.__planedb_unknown = True
-                if not self.__planedb_nagged:
-                    self.__planedb_nagged = True
-                    logging.error("icao24 %s not found in the database" % (self.__icao24))
-
-    def update(self, sbs1msg):
-        oldData = dict(self.__dict__)
-        self.__loggedDate = datetime.utcnow()
-        if sbs1msg["icao24"]:
-            self.__icao24 = sbs1msg["icao24"]
-        if sbs1msg["callsign"] and self.__callsign != sbs1msg["callsign"]:
-            self.__callsign = sbs1msg["callsign"].rstrip()
-        if sbs1msg["altitude"]:
-            self.__altitude = sbs1msg["altitude"]
-            self.__altitudeTime = datetime.utcnow()
-        if sbs1msg["groundSpeed"]:
-            self.__groundSpeed = sbs1msg["groundSpeed"]
-        if sbs1msg["track"]:
-            self.__track = sbs1msg["track"]
-        if sbs1msg["lat"]:
-            self.__lat = sbs1msg["lat"]
-            self.__latLonTime = datetime.utcnow()
-        if sbs1msg["lon"]:
-            self.__lon = sbs1msg["lon"]
-            self.__latLonTime = datetime.utcnow()
-        if sbs1msg["verticalRate"]:
-            self.__verticalRate = sbs1msg["verticalRate"]
-        if not self.__verticalRate:
-            self.__verticalRate = 0
-        if sbs1msg["generatedDate"]:
-            self.__generatedDate = sbs1msg["generatedDate"]
-        #if sbs1msg["loggedDate"]:
-        #    self.__loggedDate = sbs1msg["loggedDate"]
-
-        if args.pdb_host:
-            plane = planedb.lookup_aircraft_icao24(self.__icao24)
-            if plane:
-                self.__registration = plane['registration']
-                self.__type = plane['manufacturer'] + " " + plane['model']
-                self.__operator = plane['operator']
-            else:
-                if not self.__planedb_nagged:
-                    self.__planedb_nagged = True
-                    self.__planedb_unknown = True
-                    logging.error("icao24 %s not found in the database" % (self.__icao24))
-            if self.__callsign and not self.__route:
-                route = planedb.lookup_route(self.__callsign)
-                if route:
-                    src = planedb.lookup_airport(route['src_iata'])
-                    dst = planedb.lookup_airport(route['dst_iata'])
-                    if src and dst:
-                        if src.name:
-                            src.name = src.name.replace("\"", "'")
-                        if dst.name:
-                            dst.name = dst.name.replace("\"", "'")
-                        src.pop('id', None)
-                        src.pop('added_on', None)
-                        src.pop('updated_on', None)
-                        dst.pop('id', None)
-                        dst.pop('added_on', None)
-                        dst.pop('updated_on', None)
-                        self.__route = {'origin' : src, 'destination' : dst}
-                    else:
-                        self.__route = {}
-                else:
-                    self.__route = {}
+        t = table if table is not None else observation_table
+        s = t.allocate()
+        self.__table = t
+        self.__slot = s
+        t.icao24[s] = sbs1msg["icao24"]
+        self.update(sbs1msg, now)
+        t.dirty[s] = -1  # Everything is new
+
+    def free(self):
+        """Release the slot of this observation, the observation must not be used after this
+        """
+        self.__table.free(self.__slot)
+
+    def getSlot(self) -> int:
+        return self.__slot
+
+    def update(self, sbs1msg, now: float = None) -> int:
+        """Update the observation with an SBS1 message, setting dirty bits for
+        the fields that changed
+
+        Arguments:
+            sbs1msg {sbs1.SBS1Message} -- The message
+
+        Keyword Arguments:
+            now {float} -- time.monotonic() of the message (default: {None})
 
-        # Check if observation was updated
-        newData = dict(self.__dict__)
-        del oldData["_Observation__loggedDate"]
-        del newData["_Observation__loggedDate"]
-        d = DictDiffer(oldData, newData)
-        self.__updated = len(d.changed()) > 0
+        Returns:
+            int -- The DIRTY_* bits of the fields this message changed
+        """
+        t = self.__table
+        s = self.__slot
+        dirty = 0
+        if now is None:
+            now = time.monotonic()
+        t.seen[s] = now
+        # Only the fields the message type carries, the others are empty and left unparsed
+        fields = sbs1.TRANSMISSION_FIELDS.get(sbs1msg["transmissionType"], ())
+        if "callsign" in fields:
+            value = sbs1msg["callsign"]
+            if value and value != t.callsign[s]:
+                t.callsign[s] = value.rstrip()
+                dirty |= DIRTY_CALLSIGN
+        if "altitude" in fields:
+            value = sbs1msg["altitude"]
+            if value:
+                t.altitudeTime[s] = now
+                if value != t.altitude[s]:
+                    t.altitude[s] = value
+                    dirty |= DIRTY_ALTITUDE
+        if "groundSpeed" in fields:
+            value = sbs1msg["groundSpeed"]
+            if value and value != t.groundSpeed[s]:
+                t.groundSpeed[s] = value
+                dirty |= DIRTY_GROUND_SPEED
+            value = sbs1msg["track"]
+            if value and value != t.track[s]:
+                t.track[s] = value
+                dirty |= DIRTY_TRACK
+        if "lat" in fields:
+            value = sbs1msg["lat"]
+            if value:
+                t.latLonTime[s] = now
+                if value != t.lat[s]:
+                    t.lat[s] = value
+                    dirty |= DIRTY_LAT
+            value = sbs1msg["lon"]
+            if value:
+                t.latLonTime[s] = now
+                if value != t.lon[s]:
+                    t.lon[s] = value
+                    dirty |= DIRTY_LON
+        if "verticalRate" in fields:
+            value = sbs1msg["verticalRate"]
+            current = t.verticalRate[s]
+            if not value:
+                # NaN is not equal to itself, and unknown
+                value = current if current and current == current else 0
+            if value != current:
+                t.verticalRate[s] = value
+                dirty |= DIRTY_VERTICAL_RATE
+
+        t.dirty[s] |= dirty
+        return dirty
+
+    def needsAircraft(self, now: float) -> bool:
+        """Return True if the plane database has not been asked about this aircraft yet,
+        or the lookup failed and it is time to retry
+
+        Arguments:
+            now {float} -- time.monotonic()
+        """
+        # NaN unless a lookup has failed, and then never less than anything
+        return not self.__table.flags[self.__slot] & Observation.FLAG_PLANEDB_DONE and not now < self.__table.aircraftRetry[self.__slot]
+
+    def needsRoute(self, now: float) -> bool:
+        """Return True if the callsign is known but not the route, unless the
+        lookup failed and it is not yet time to retry
+
+        Arguments:
+            now {float} -- time.monotonic()
+        """
+        t = self.__table
+        s = self.__slot
+        return t.callsign[s] is not None and t.route[s] is None and not now < t.routeRetry[s]
+
+    def needsImage(self) -> bool:
+        """Return True if the plane database knows the aircraft but has no image and none has been searched for
+        """
+        flags = self.__table.flags[self.__slot]
+        image_url = self.__table.image_url[self.__slot]
+        return flags & Observation.FLAG_PLANEDB_DONE and not flags & (Observation.FLAG_PLANEDB_UNKNOWN | Observation.FLAG_IMAGE_SEARCHED) and (image_url is None or len(image_url) < 2)
+
+    def setAircraft(self, plane: dict|None, failed: bool = False, now: float = None):
+        """Merge the result of a plane database lookup
+
+        Arguments:
+            plane {dict|None} -- Aircraft from the plane database or None if not found
+
+        Keyword Arguments:
+            failed {bool} -- The lookup failed, the aircraft is not known to be unknown and is looked up again later (default: {False})
+            now {float} -- time.monotonic() of the failure (default: {None})
+        """
+        t = self.__table
+        s = self.__slot
+        if failed:
+            t.aircraftRetry[s] = (time.monotonic() if now is None else now) + AIRCRAFT_RETRY_INTERVAL
+            return
+        t.flags[s] |= Observation.FLAG_PLANEDB_DONE
+        if plane:
+            if plane['registration'] != t.registration[s]:
+                t.registration[s] = plane['registration']
+                t.dirty[s] |= DIRTY_REGISTRATION
+            value = plane['manufacturer'] + " " + plane['model']
+            if value != t.type[s]:
+                t.type[s] = value
+                t.dirty[s] |= DIRTY_TYPE
+            if plane['operator'] != t.operator[s]:
+                t.operator[s] = plane['operator']
+                t.dirty[s] |= DIRTY_OPERATOR
+            if plane['image'] and plane['image'] != t.image_url[s]:
+                t.image_url[s] = plane['image']
+                t.dirty[s] |= DIRTY_IMAGE
+        else:
+            t.flags[s] |= Observation.FLAG_PLANEDB_UNKNOWN
+            if not t.flags[s] & Observation.FLAG_PLANEDB_NAGGED:
+                t.flags[s] |= Observation.FLAG_PLANEDB_NAGGED
+                logging.error("icao24 %s not found in the database" % (t.icao24[s]))
+
+    def setRoute(self, route: dict|None, route_json: str|None, failed: bool = False, now: float = None):
+        """Merge the route of the flight and its JSON representation, an empty dict if unknown
+
+        Keyword Arguments:
+            failed {bool} -- The lookup failed, the route is looked up again later (default: {False})
+            now {float} -- time.monotonic() of the failure (default: {None})
+        """
+        t = self.__table
+        s = self.__slot
+        if failed:
+            t.routeRetry[s] = (time.monotonic() if now is None else now) + ROUTE_RETRY_INTERVAL
+            return
+        if route != t.route[s]:
+            t.route[s] = route
+            t.route_json[s] = route_json
+            t.dirty[s] |= DIRTY_ROUTE
+
+    def setImageUrl(self, url: str|None):
+        """Merge the result of an image search
+        """
+        t = self.__table
+        s = self.__slot
+        t.flags[s] |= Observation.FLAG_IMAGE_SEARCHED
+        if url and url != t.image_url[s]:
+            t.image_url[s] = url
+            t.dirty[s] |= DIRTY_IMAGE
 
     def getIcao24(self) -> str:
-        return self.__icao24
+        return self.__table.icao24[self.__slot]
+
+    def getCallsign(self) -> str:
+        return self.__table.callsign[self.__slot]
 
     def getLat(self) -> float:
-        return self.__lat
+        value = self.__table.lat[self.__slot]
+        return None if value != value else value
 
     def getLon(self) -> float:
-        return self.__lon
+        value = self.__table.lon[self.__slot]
+        return None if value != value else value
 
     def isUpdated(self) -> bool:
-        return self.__updated
+        return self.__table.dirty[self.__slot] != 0
+
+    def clearDirty(self):
+        """Forget the changed fields, done when the publish thread is handed a snapshot
+        """
+        self.__table.dirty[self.__slot] = 0
+
+    def getLastSeen(self) -> float:
+        """Return the time.monotonic() the aircraft was last heard from
+        """
+        return self.__table.seen[self.__slot]
 
     def getLoggedDate(self) -> datetime:
-        return self.__loggedDate
+        return datetime.utcfromtimestamp(self.__table.epoch + self.__table.seen[self.__slot])
 
     def getGroundSpeed(self) -> float:
-        return self.__groundSpeed
+        value = self.__table.groundSpeed[self.__slot]
+        return None if value != value else value
 
     def getHeading(self) -> float:
-        return self.__track
+        value = self.__table.track[self.__slot]
+        return None if value != value else value
 
     def getAltitude(self) -> float:
-        return self.__altitude
+        value = self.__table.altitude[self.__slot]
+        return None if value != value else value
+
+    def getVerticalRate(self) -> float:
+        value = self.__table.verticalRate[self.__slot]
+        return None if value != value else value
 
     def getType(self) -> str:
-        return self.__type
+        return self.__table.type[self.__slot]
 
     def getRegistration(self) -> str:
-        return self.__registration
+        return self.__table.registration[self.__slot]
 
     def getOperator(self) -> str:
-        return self.__operator
+        return self.__table.operator[self.__slot]
 
     def getRoute(self) -> str:
-        return self.__route
+        return self.__table.route[self.__slot]
 
     def getImageUrl(self) -> str:
-        return self.__image_url
+        return self.__table.image_url[self.__slot]
 
     def isPresentable(self) -> bool:
-        return self.__altitude and self.__groundSpeed and self.__track and self.__lat and self.__lon and self.__image_url
+        t = self.__table
+        s = self.__slot
+        (altitude, speed, track, lat, lon) = (t.altitude[s], t.groundSpeed[s], t.track[s], t.lat[s], t.lon[s])
+        # NaN is not equal to itself, so unknown values fail the tests
+        return bool(altitude and altitude == altitude and speed and speed == speed and track and track == track and lat and lat == lat and lon and lon == lon and t.image_url[s])
 
     def dump(self):
         """Dump this observation on the console
         """
         now = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')
-        logging.debug("> %s  %s %-7s - trk:%3d spd:%3d alt:%5d (%5d) %.4f, %.4f" % (now, self.__icao24, self.__callsign, self.__track, self.__groundSpeed, self.__altitude, self.__verticalRate, self.__lat, self.__lon))
+        logging.debug("> %s  %s %-7s - trk:%3d spd:%3d alt:%5d (%5d) %.4f, %.4f" % (now, self.getIcao24(), self.getCallsign(), self.getHeading(), self.getGroundSpeed(), self.getAltitude(), self.getVerticalRate(), self.getLat(), self.getLon()))
 
     def isKnown(self) -> bool:
         """Return True if this plane is known in the database
@@ -254,7 +462,7 @@ class Observation(object):
         Returns:
             bool: True if plane is known, False otherwise
         """
-        return not self.__planedb_unknown
+        return not self.__table.flags[self.__slot] & Observation.FLAG_PLANEDB_UNKNOWN
 
     def isKnownNagged(self) -> bool:
         """If the plane is unknown, return False __once__. Why on earth is this?
@@ -267,9 +475,14 @@ class Observation(object):
             bool: True if plane is known or we have called this function several times
                   False if the plans is unknown and this is the first time we call the function
         """
-        if not self.__planedb_unknown_nagged:
-            self.__planedb_unknown_nagged = True
-            return not self.__planedb_unknown
+        t = self.__table
+        s = self.__slot
+        if not t.flags[s] & Observation.FLAG_PLANEDB_DONE:
+            # Don't know yet
+            return True
+        if not t.flags[s] & Observation.FLAG_PLANEDB_UNKNOWN_NAGGED:
+            t.flags[s] |= Observation.FLAG_PLANEDB_UNKNOWN_NAGGED
+            return not t.flags[s] & Observation.FLAG_PLANEDB_UNKNOWN
         else:
             return True
 
@@ -283,39 +496,36 @@ class Observation(object):
         Returns:
             str -- JSON string
         """
-        if self.__route is None:
-            route = "\"\""
-        else:
-            route = "%s" % self.__route
-            route = route.replace("'", "\"")
+        return self.snapshot().json(bearing, distance)
 
-        if self.__callsign is None:
-            callsign = "\"\""
-        else:
-            callsign = "\"%s\"" % self.__callsign
 
-        distance = distance / 1000
-        global counter
-        counter += 1
-        # TODO: Use json.dumps instead
-        return '{"vspeed": %d, "time": %d, "lat": %.5f, "lon": %.5f, "distance": %.5f, "image": "%s", "altitude": %d, "speed": %d, "icao24": "%s", "registration": "%s", "heading": %d, "operator": "%s", "bearing": %d, "loggedDate": "%s", "type": "%s", "callsign": %s, "route" : %s, "counter": %d}' % \
-            (self.__verticalRate, time.time(), self.__lat, self.__lon, distance, self.__image_url, self.__altitude, self.__groundSpeed, self.__icao24, self.__registration, self.__track, self.__operator, bearing, self.__loggedDate, self.__type, callsign, route, counter)
+    def snapshot(self) -> ObservationSnapshot:
+        """Return a copy of the current state that does not change when the observation does
+        """
+        t = self.__table
+        s = self.__slot
+        return ObservationSnapshot(t.icao24[s], t.callsign[s], t.altitude[s], t.groundSpeed[s], t.track[s], t.lat[s], t.lon[s], t.verticalRate[s],
+                                   t.seen[s], t.epoch + t.seen[s], t.operator[s], t.registration[s], t.type[s], t.route[s], t.route_json[s], t.image_url[s])
 
 
     def dict(self):
-        d =  dict(self.__dict__)
+        t = self.__table
+        s = self.__slot
+        d = {"_Observation__" + name: getattr(t, name)[s] for name in OBJECT_COLUMNS}
+        d.update({"_Observation__" + name: getattr(self, "get" + name[0].upper() + name[1:])() for name in ("altitude", "groundSpeed", "lat", "lon", "verticalRate")})
+        d["_Observation__track"] = self.getHeading()
+        d["_Observation__loggedDate"] = self.getLoggedDate()
+        d["_Observation__dirty"] = t.dirty[s]
         if d["_Observation__verticalRate"] == None:
             d["verticalRate"] = 0
-        if "_Observation__lastAlt" in d:
-            del d["lastAlt"]
-        if "_Observation__lastLat" in d:
-            del d["lastLat"]
-        if "_Observation__lastLon" in d:
-            del d["lastLon"]
         d["loggedDate"] = "%s" % (d["_Observation__loggedDate"])
         return d
 
 
+# Observations not given a table of their own
+observation_table = ObservationTable()
+
+
 class FlightTracker(object):
     __dump1090_host: str = ""
     __dump1090_port: int = 0
@@ -324,15 +534,16 @@ class FlightTracker(object):
     __latitude: float = 0
     __longitude: float = 0
     __dump1090_sock: socket.socket = None
+    __dump1090_reader: LineReader = None
     __mqtt_bridge = None
     __observations: Dict[str, str] = {}
     __tracking_icao24: str = None
     __tracking_distance: int = 999999999
-    __next_clean: datetime = None
+    __next_clean: float = 0
     __has_nagged: bool = False
     __unknown_aircraft_topic: str = None
 
-    def __init__(self, dump1090_host: str, mqtt_broker: str, latitude: float, longitude: float, proximity_topic: str, dump1090_port: int = 30003, mqtt_port: int = 1883, unknown_aircraft_topic: str = None):
+    def __init__(self, dump1090_host: str, mqtt_broker: str, latitude: float, longitude: float, proximity_topic: str, dump1090_port: int = 30003, mqtt_port: int = 1883, unknown_aircraft_topic: str = None, feeds: List[Feed] = None, dedup_window: float = 0, record_path: str = None, enrichment_workers: int = ENRICHMENT_WORKERS, geodesy_accuracy: float = GEODESY_ACCURACY, observation_timeout: float = OBSERVATION_TIMEOUT, binary_topic: str = None, keyframe_interval: float = None):
         """Initialize the flight tracker
 
         Arguments:
@@ -346,6 +557,14 @@ class FlightTracker(object):
         Keyword Arguments:
             dump1090_port {int} -- Override the dump1090 raw port (default: {30003})
             mqtt_port {int} -- Override the MQTT default port (default: {1883})
+            feeds {List[Feed]} -- Additional SBS1 feeds read alongside the dump1090 host (default: {None})
+            dedup_window {float} -- Drop messages repeated within this many seconds, 0 to disable (default: {0})
+            record_path {str} -- Record the received SBS1 data to segment files with this base name (default: {None})
+            enrichment_workers {int} -- Number of threads doing plane database lookups and image searches (default: {ENRICHMENT_WORKERS})
+            geodesy_accuracy {float} -- Max distance error in meters within GEODESY_RANGE, see utils.geodesy_error_bound (default: {GEODESY_ACCURACY})
+            observation_timeout {float} -- Forget aircraft not heard from in this many seconds (default: {OBSERVATION_TIMEOUT})
+            binary_topic {str} -- MQTT topic for binary proximity reports, see proximity.py (default: {None})
+            keyframe_interval {float} -- Publish proximity reports as deltas with a keyframe this often in seconds, see proximity.py. None for full reports only. (default: {None})
         """
         self.__dump1090_host = dump1090_host
         self.__dump1090_port = dump1090_port
@@ -353,11 +572,31 @@ class FlightTracker(object):
         self.__mqtt_port = mqtt_port
         self.__latitude = latitude
         self.__longitude = longitude
+        mode = utils.select_geodesy_mode(latitude, GEODESY_RANGE, geodesy_accuracy)
+        logging.info("Using %s geodesy (%.2fm error within %d km)" % (mode, utils.geodesy_error_bound(mode, latitude, GEODESY_RANGE), GEODESY_RANGE / 1000))
+        self.__observer = utils.Observer(latitude, longitude, mode, GEODESY_RANGE)
         self.__sock = None
         self.__observations = {}
-        self.__next_clean = datetime.utcnow() + timedelta(seconds=OBSERVATION_CLEAN_INTERVAL)
+        self.__table = ObservationTable()  # State of the observations
+        self.__positions = SpatialIndex()  # Positions of observations
+        self.__expiry = ExpiryQueue(observation_timeout)  # Last seen time of observations
+        self.__publish_cond = threading.Condition()  # Notified when the tracked aircraft changes
+        self.__tracked = None  # ObservationSnapshot of the tracked aircraft, only ever replaced, never modified
+        self.__clock = time.monotonic  # Time of the messages, that of the recording during playback
+        self.__clock_speed = 1  # Clock seconds per second, 0 if it only moves with the messages
+        self.__next_clean = self.__clock() + OBSERVATION_CLEAN_INTERVAL
         self.__prox_topic = proximity_topic
         self.__unknown_aircraft_topic = unknown_aircraft_topic
+        self.__binary_topic = binary_topic
+        self.__delta = DeltaEncoder(keyframe_interval) if keyframe_interval else None
+        self.__feeds = feeds if feeds else []
+        self.__dedup = DedupFilter(dedup_window) if dedup_window > 0 else None
+        self.__recorder = Recorder(record_path) if record_path else None
+        self.__enrichment = None
+        self.__aircraft_batcher = None
+        if args.pdb_host or args.snapshot:
+            self.__enrichment = EnrichmentPool(enrichment_workers)
+            self.__aircraft_batcher = LookupBatcher(self.__enrichment, "aircraft", planecache.lookup_aircraft_icao24_batch)
 
 
     def dump1090Connect(self) -> bool:
@@ -374,6 +613,7 @@ class FlightTracker(object):
                 self.__dump1090_sock.connect((self.__dump1090_host, self.__dump1090_port))
                 logging.info("ADSB connected")
                 self.__dump1090_sock.settimeout(DUMP1090_SOCKET_TIMEOUT)
+                self.__dump1090_reader = LineReader(self.__dump1090_sock)
                 self.__has_nagged = False
                 return True
             except socket.error as e:
@@ -395,117 +635,203 @@ class FlightTracker(object):
         except socket.error:
             pass
         self.__dump1090_sock = None
+        self.__dump1090_reader = None
         self.__has_nagged = False
 
 
-    def dump1090Read(self) -> str:
-        """Read a line from the dump1090 host. If the host went down, close the socket and return None
-
-        Returns:
-            str -- An SBS1 message or None if disconnected or timeout
+    def dump1090Read(self) -> Iterator[str|None]:
+        """Read lines from the dump1090 host as they arrive. If the host went down, close the socket and yield None
 
         Yields:
             str -- An SBS1 message or None if disconnected or timeout
         """
         try:
-            try:
-                buffer = self.__dump1090_sock.recv(4096)
-            except ConnectionResetError:
-                logging.warning("Connection reset")
-                self.dump1090Close()
-                yield None
-            except socket.error:
-                logging.warning("Socket error")
-                self.dump1090Close()
-                yield None
-            if buffer is None:
-                self.dump1090Close()
-                return None
-            buffer = buffer.decode("utf-8")
-            buffering = True
-            if buffer == "":
-                self.dump1090Close()
-                return None
-            while buffering:
-                if "\n" in buffer:
-                    (line, buffer) = buffer.split("\r\n", 1)
-                    yield line
-                else:
-                    try:
-                        more = self.__dump1090_sock.recv(4096)
-                    except ConnectionResetError:
-                        logging.warning("Connection reset")
-                        self.dump1090Close()
-                        yield None
-                    except socket.error:
-                        logging.warning("Socket error")
-                        self.dump1090Close()
-                        yield None
-                    if not more:
-                        buffering = False
-                    else:
-                        try:
-                            more = more.decode("utf-8")
-                        except AttributeError:
-                            pass
-                        if more == "":
-                            self.dump1090Close()
-                            return None
-                        buffer += more
-            if buffer:
-                yield buffer
+            while True:
+                for line in self.__dump1090_reader.lines():
+                    yield line.decode("utf-8", "replace")
+                if self.__dump1090_reader.fill() == 0:
+                    logging.warning("Connection closed")
+                    break
         except socket.timeout:
             yield None
+            return
+        except ConnectionResetError:
+            logging.warning("Connection reset")
+        except socket.error:
+            logging.warning("Socket error")
+        self.dump1090Close()
+        yield None
 
 
     def __publish_thread(self):
         """
-        MQTT publish closest observation every second, more often if the plane is closer
+        MQTT publish closest observation, more often the closer it is and the
+        faster it approaches. Sleeps until the next report is due or the
+        tracked aircraft changes. Only the snapshot of the tracked aircraft
+        is read, never the observations the ingest thread is updating.
         """
+        serializer = JSONSerializer()
+        encoder = BinaryEncoder()
+        published = None  # icao24 of the last report
+        next_publish = 0
         while True:
-            if not self.__tracking_icao24:
-                time.sleep(1)
-            else:
-                if not self.__tracking_icao24 in self.__observations:
-                    self.__tracking_icao24 is None
-                    continue
-                cur = self.__observations[self.__tracking_icao24]
-                if cur is None:
-                    continue
-                (lat, lon) = utils.calc_travel(cur.getLat(), cur.getLon(), cur.getLoggedDate(), cur.getGroundSpeed(), cur.getHeading())
-                distance = utils.coordinate_distance(self.__latitude, self.__longitude, lat, lon)
+            with self.__publish_cond:
+                while True:
+                    cur = self.__tracked
+                    if cur is None:
+                        # Nothing to do until there is something to track
+                        self.__publish_cond.wait()
+                    elif cur.icao24 != published:
+                        break
+                    else:
+                        timeout = next_publish - self.__clock()
+                        if timeout <= 0:
+                            break
+                        # Wait in seconds, or for the messages to move the clock
+                        self.__publish_cond.wait(timeout / self.__clock_speed if self.__clock_speed else PUBLISH_MIN_INTERVAL)
+            # Pick up the latest snapshot, it may have been replaced while we slept
+            cur = self.__tracked
+            if cur is None:
+                continue
+            published = cur.icao24
+            now = self.__clock()
+            try:
+                (lat, lon) = utils.calc_travel2(cur.lat, cur.lon, now - cur.seen, cur.groundSpeed, cur.track)
+                distance = self.__observer.distance(lat, lon)
+                bearing = self.__observer.bearing(lat, lon)
+                # Speed towards us, the aircraft approaches when heading opposite to our bearing to it
+                closing_speed = 0.514444 * cur.groundSpeed * math.cos(math.radians(cur.track - bearing - 180))
+                next_publish = now + publish_interval(distance, closing_speed)
                 # Round off to nearest 100 meters
                 distance = round(distance/100) * 100
-                bearing = utils.bearing(self.__latitude, self.__longitude, lat, lon)
 
                 # @todo: update altitude
                 # altitude = sbs1["altitude"]
 
                 retain = False
-                self.__mqtt_bridge.client.publish(self.__prox_topic, cur.json(bearing, distance), 0, retain)
-                logging.info("%s at %5d brg %3d alt %5d trk %3d spd %3d %s" % (cur.getIcao24(), distance, bearing, cur.getAltitude(), cur.getHeading(), cur.getGroundSpeed(), cur.getType()))
+                self.__mqtt_bridge.client.publish(self.__prox_topic, cur.json(bearing, distance, serializer, self.__delta), 0, retain)
+                if self.__binary_topic:
+                    (payload, strings) = encoder.encode(cur, bearing, distance, time.time(), counter)
+                    for (id, string) in strings:
+                        # Retained, so that displays get the strings they have missed
+                        self.__mqtt_bridge.client.publish("%s/strings/%d" % (self.__binary_topic, id), string.encode("utf-8"), 1, True)
+                    self.__mqtt_bridge.client.publish(self.__binary_topic, payload, 0, retain)
+                logging.info("%s at %5d brg %3d alt %5d trk %3d spd %3d %s" % (cur.icao24, distance, bearing, cur.altitude, cur.track, cur.groundSpeed, cur.type))
+            except Exception:
+                # Keep the thread alive and try again a while later
+                logging.error("Failed to publish %s" % (cur.icao24), exc_info = True)
+                next_publish = now + PUBLISH_MAX_INTERVAL
+
+
+    def setTracking(self, icao24: str|None, distance: float = 999999999):
+        """Track an aircraft, waking up the publish thread if it is a new one
 
-                if distance < 3000:
-                    time.sleep(0.25)
-                elif distance < 6000:
-                    time.sleep(0.5)
+        Arguments:
+            icao24 {str|None} -- Aircraft to track, None for none
+
+        Keyword Arguments:
+            distance {float} -- Its distance in meters (default: {999999999})
+        """
+        with self.__publish_cond:
+            self.__tracking_distance = distance
+            if icao24 != self.__tracking_icao24:
+                self.__tracking_icao24 = icao24
+                if icao24:
+                    observation = self.__observations[icao24]
+                    self.__tracked = observation.snapshot()
+                    observation.clearDirty()
                 else:
-                    time.sleep(1)
+                    self.__tracked = None
+                self.__publish_cond.notify()
+
+
+    def refreshTracked(self, observation: Observation):
+        """Hand a new snapshot to the publish thread if observation is the tracked aircraft
+        and something has changed since the last one
+        """
+        if observation.getIcao24() == self.__tracking_icao24 and observation.isUpdated():
+            # Replacing the reference is atomic, no lock needed
+            self.__tracked = observation.snapshot()
+            observation.clearDirty()
+
+
+    def getObservation(self, icao24: str) -> Observation|None:
+        """Return the observation of an aircraft, only to be used by the thread calling handleMessage
+        """
+        return self.__observations.get(icao24)
 
 
     def updateTrackingDistance(self):
         """Update distance to aircraft being tracked
         """
         cur = self.__observations[self.__tracking_icao24]
-        self.__tracking_distance = utils.coordinate_distance(self.__latitude, self.__longitude, cur.getLat(), cur.getLon())
+        self.__tracking_distance = self.__observer.distance(cur.getLat(), cur.getLon())
+
+
+    def startPublishing(self, bridge: "mqtt_wrapper.bridge" = None):
+        """Connect to the MQTT broker and start the publish thread
+
+        Keyword Arguments:
+            bridge {mqtt_wrapper.bridge} -- Publish through this bridge instead of connecting to the broker (default: {None})
+        """
+        if bridge is not None:
+            self.__mqtt_bridge = bridge
+        else:
+            logging.info("Connecting to MQTT broker on %s:%s" % (self.__mqtt_broker, self.__mqtt_port))
+            self.__mqtt_bridge = mqtt_wrapper.bridge(host = self.__mqtt_broker, port = self.__mqtt_port, mqtt_topic = "foobar", client_id = "FlightTracker-%d" % (os.getpid())) # TOOD: , user_id = args.mqtt_user, password = args.mqtt_password)
+        if self.__delta:
+            # Subscribers that have lost reports ask for a keyframe
+            topic = "%s/keyframe" % (self.__prox_topic)
+            self.__mqtt_bridge.client.message_callback_add(topic, lambda client, userdata, msg: self.__delta.requestKeyframe())
+            self.__mqtt_bridge.client.subscribe(topic)
+        if self.__delta or self.__binary_topic:
+            # Handle the keyframe requests and the acknowledges of the QoS 1 strings,
+            # paho stops sending QoS 1 messages when too many are unacknowledged
+            self.__mqtt_bridge.client.loop_start()
+        threading.Thread(target = self.__publish_thread, daemon = True).start()
+
+
+    def replay(self, paths: List[str], speed: float = 1):
+        """Play back recorded SBS1 data through the flight tracker and log the throughput
+
+        Arguments:
+            paths {List[str]} -- Recordings to play back, in order
+
+        Keyword Arguments:
+            speed {float} -- Playback speed factor, 0 for as fast as possible (default: {1})
+        """
+        # Expire, dead reckon and publish in the time of the recording
+        clock = recorder.PlaybackClock(speed)
+        self.__clock = clock
+        self.__clock_speed = speed
+        self.startPublishing()
+        count = 0
+        start = time.monotonic()
+        for data in recorder.replay(paths, speed, clock):
+            self.handleMessage(data, clock())
+            count += 1
+        elapsed = time.monotonic() - start
+        logging.info("Played back %d messages in %.1f seconds (%.0f msgs/s)" % (count, elapsed, count / elapsed if elapsed > 0 else 0))
+
+
+    def close(self):
+        """Close the recording, if any, so that its last segment can be played back
+        """
+        if self.__recorder:
+            self.__recorder.close()
 
 
     def run(self):
         """Run the flight tracker.
         """
-        logging.info("Connecting to MQTT broker on %s:%s" % (self.__mqtt_broker, self.__mqtt_port))
-        self.__mqtt_bridge = mqtt_wrapper.bridge(host = self.__mqtt_broker, port = self.__mqtt_port, mqtt_topic = "foobar", client_id = "FlightTracker-%d" % (os.getpid())) # TOOD: , user_id = args.mqtt_user, password = args.mqtt_password)
-        threading.Thread(target = self.__publish_thread, daemon = True).start()
+        self.startPublishing()
+
+        if self.__feeds:
+            # Read the dump1090 host and the additional feeds concurrently
+            feeds = [Feed(self.__dump1090_host, self.__dump1090_port)] + self.__feeds
+            engine = IngestEngine(feeds, lambda line, feed: self.handleMessage(line.decode("utf-8", "replace")))
+            asyncio.run(engine.run())
+            return
 
         while True:
             logging.info("Connecting to dump1090")
@@ -514,72 +840,165 @@ class FlightTracker(object):
             for data in self.dump1090Read():
                 if data is None:
                     break
-                self.cleanObservations()
-                m = sbs1.parse(data)
-                if m:
-                    icao24 = m["icao24"]
-                    if icao24 == "000000":  # "Ghost data" sometimes received by dump1090, ignore
-                        continue
-                    if icao24 in self.__observations:
-                        self.__observations[icao24].update(m)
-                    else:
-                        self.__observations[icao24] = Observation(m)
-
-                    if self.__observations[icao24].isPresentable():
-                        if not self.__tracking_icao24:
-                            self.__tracking_icao24 = icao24
-                            self.updateTrackingDistance()
-                            logging.info("Tracking %s at %d" % (self.__tracking_icao24, self.__tracking_distance))
-                        elif self.__tracking_icao24 == icao24:
-                            self.updateTrackingDistance()
+                self.handleMessage(data)
+
+
+    def handleMessage(self, data: str, now: float = None):
+        """Handle an SBS1 message from one of the feeds
+
+        Arguments:
+            data {str} -- The SBS1 message
+
+        Keyword Arguments:
+            now {float} -- Time of the message, time.monotonic() or that of the recording being played back (default: {None} for now)
+        """
+        if self.__recorder:
+            self.__recorder.write(data)
+        if now is None:
+            now = self.__clock()
+        if self.__enrichment:
+            self.__aircraft_batcher.poll()
+            if self.__enrichment.hasResults():
+                self.mergeEnrichments(now)
+        self.cleanObservations(now)
+        m = sbs1.parse(data, lazy=True)
+        if m:
+            icao24 = m["icao24"]
+            if icao24 == "000000":  # "Ghost data" sometimes received by dump1090, ignore
+                return
+            if self.__dedup and self.__dedup.isDuplicate(m, now):
+                return
+            if icao24 in self.__observations:
+                dirty = self.__observations[icao24].update(m, now)
+            else:
+                self.__observations[icao24] = Observation(m, self.__table, now)
+                dirty = -1
+            observation = self.__observations[icao24]
+            self.__expiry.touch(icao24, now)
+            moved = dirty & (DIRTY_LAT | DIRTY_LON)
+            if moved and observation.getLat() is not None and observation.getLon() is not None:
+                self.__positions.update(icao24, observation.getLat(), observation.getLon())
+            if self.__enrichment:
+                self.enrich(observation, now)
+
+            if observation.isPresentable():
+                if not self.__tracking_icao24:
+                    self.setTracking(icao24, self.__observer.distance(observation.getLat(), observation.getLon()))
+                    logging.info("Tracking %s at %d" % (self.__tracking_icao24, self.__tracking_distance))
+                elif self.__tracking_icao24 == icao24:
+                    self.updateTrackingDistance()
+                    self.refreshTracked(observation)
+                elif moved:
+                    distance = self.__observer.distance(observation.getLat(), observation.getLon())
+                    if distance < self.__tracking_distance:
+                        self.setTracking(icao24, distance)
+                        logging.info("Now tracking %s at %d" % (self.__tracking_icao24, self.__tracking_distance))
+            if not self.__observations[icao24].isKnownNagged() and self.__unknown_aircraft_topic is not None:
+                self.__mqtt_bridge.client.publish(self.__unknown_aircraft_topic, icao24)
+
+
+    def enrich(self, observation: Observation, now: float):
+        """Queue lookups for whatever the observation is missing, the results
+        are merged by mergeEnrichments
+
+        Arguments:
+            observation {Observation} -- The observation
+            now {float} -- Time of the message, as in handleMessage
+        """
+        icao24 = observation.getIcao24()
+        if observation.needsAircraft(now):
+            # Batched as aircraft tend to appear in bursts
+            self.__aircraft_batcher.add(icao24)
+        if observation.needsRoute(now):
+            self.__enrichment.submit(("route", icao24), resolve_route, observation.getCallsign())
+        if observation.needsImage():
+            self.__enrichment.submit(("image", icao24), utils.image_search, icao24, observation.getOperator(), observation.getType(), observation.getRegistration())
+
+
+    def mergeEnrichments(self, now: float):
+        """Merge finished lookups into the observations
+
+        Arguments:
+            now {float} -- Time of the message being handled, as in handleMessage
+        """
+        for ((kind, icao24), result, error) in self.__enrichment.results():
+            if kind == "aircraft":
+                self.__aircraft_batcher.done(icao24)
+                for key in icao24:
+                    observation = self.__observations.get(key)
+                    if observation is not None:
+                        if result is not None and key in result:
+                            observation.setAircraft(result[key])
                         else:
-                            distance = utils.coordinate_distance(self.__latitude, self.__longitude, self.__observations[icao24].getLat(), self.__observations[icao24].getLon())
-                            if distance < self.__tracking_distance:
-                                self.__tracking_icao24 = icao24
-                                self.__tracking_distance = distance
-                                logging.info("Now tracking %s at %d" % (self.__tracking_icao24, self.__tracking_distance))
-                    if not self.__observations[icao24].isKnownNagged() and self.__unknown_aircraft_topic is not None:
-                        self.__mqtt_bridge.client.publish(self.__unknown_aircraft_topic, icao24)
+                            observation.setAircraft(None, failed = True, now = now)
+                        self.refreshTracked(observation)
+                continue
+            observation = self.__observations.get(icao24)
+            if observation is None:
+                # Gone while we were looking
+                continue
+            if kind == "route":
+                if error is not None:
+                    observation.setRoute(None, None, failed = True, now = now)
+                else:
+                    observation.setRoute(*(result if result else ({}, "{}")))
+            elif kind == "image":
+                observation.setImageUrl(result)
+            self.refreshTracked(observation)
 
 
-    def selectNearestObservation(self):
+    def selectNearestObservation(self, now: float):
         """Select nearest presentable aircraft
+
+        Arguments:
+            now {float} -- Time to dead reckon the aircraft to, as in cleanObservations
         """
-        self.__tracking_icao24 = None
-        self.__tracking_distance = 999999999
-        for icao24 in self.__observations:
-            if not self.__observations[icao24].isPresentable():
-                continue
-            distance = utils.coordinate_distance(self.__latitude, self.__longitude, self.__observations[icao24].getLat(), self.__observations[icao24].getLon())
-            if distance < self.__tracking_distance:
-                self.__tracking_icao24 = icao24
-                self.__tracking_distance = distance
-        if self.__tracking_icao24 is None:
+        tracking = None
+        nearest = self.__positions.nearest(self.__latitude, self.__longitude, lambda icao24: self.__observations[icao24].isPresentable())
+        if nearest:
+            # Pick the one nearest now, not where they were last heard, as publishing does
+            candidates = [self.__observations[icao24] for (icao24, _) in self.__positions.within(self.__latitude, self.__longitude, nearest[1] + SELECT_MARGIN)]
+            candidates = [cur for cur in candidates if cur.isPresentable()]
+            slots = np.array([cur.getSlot() for cur in candidates], dtype=np.intp)
+            t = self.__table
+            (lat, lon) = utils.calc_travel2_array(t.column("lat", slots), t.column("lon", slots), now - t.column("seen", slots),
+                                                  t.column("groundSpeed", slots), t.column("track", slots))
+            distance = self.__observer.distanceArray(lat, lon)
+            i = int(np.argmin(distance))
+            tracking = (candidates[i].getIcao24(), float(distance[i]))
+        if tracking is None:
+            self.setTracking(None)
             logging.info("Found nothing to track")
         else:
+            self.setTracking(*tracking)
             logging.info("Found new tracking %s at %d" % (self.__tracking_icao24, self.__tracking_distance))
 
 
-    def cleanObservations(self):
+    def cleanObservations(self, now: float):
         """Clean observations for planes not seen in a while
+
+        Arguments:
+            now {float} -- time.monotonic(), or the time of the recording being played back
         """
-        now = datetime.utcnow()
+        for icao24 in self.__expiry.expired(now):
+            logging.info("%s disappeared" % (icao24))
+            self.__observations.pop(icao24).free()
+            self.__positions.remove(icao24)
+            if icao24 == self.__tracking_icao24:
+                self.selectNearestObservation(now)
+
         if now > self.__next_clean:
-            cleaned = []
-            for icao24 in self.__observations:
-#                logging.info("[%s] %s -> %s : %s" % (icao24, self.__observations[icao24].getLoggedDate(), self.__observations[icao24].getLoggedDate() + timedelta(seconds=OBSERVATION_CLEAN_INTERVAL), now))
-                if self.__observations[icao24].getLoggedDate() + timedelta(seconds=OBSERVATION_CLEAN_INTERVAL) < now:
-                    logging.info("%s disappeared" % (icao24))
-                    if icao24 == self.__tracking_icao24:
-                        self.__tracking_icao24 = None
-                    cleaned.append(icao24)
-
-            for icao24 in cleaned:
-                del self.__observations[icao24]
             if self.__tracking_icao24 is None:
-                self.selectNearestObservation()
+                self.selectNearestObservation(now)
 
-            self.__next_clean = now + timedelta(seconds=OBSERVATION_CLEAN_INTERVAL)
+            if args.pdb_host or args.snapshot:
+                planecache.log_stats()
+            if self.__enrichment:
+                logging.info(self.__enrichment.stats())
+            if self.__dedup:
+                logging.info("Dropped %d of %d messages as duplicates (%.1f%%)" % (self.__dedup.dropped, self.__dedup.messages, 100 * self.__dedup.getDropRate()))
+
+            self.__next_clean = now + OBSERVATION_CLEAN_INTERVAL
 
 
 def main():
@@ -596,8 +1015,20 @@ def main():
     parser.add_argument('-a', '--mqtt-password', help="MQTT broker password")
     parser.add_argument('-H', '--dump1090-host', help="dump1090 hostname", default='127.0.0.1')
     parser.add_argument('-P', '--dump1090-port', type=int, help="dump1090 port number (default 30003)", default=30003)
+    parser.add_argument('-F', '--feed', dest='feeds', action='append', type=parse_feed, help="Additional SBS1 feed as host:port, may be given several times")
+    parser.add_argument('-D', '--dedup-window', type=float, help="Drop messages repeated within this many seconds, eg. when the same aircraft is heard by several feeds (default %d when --feed is given, otherwise 0 which disables it)" % DEDUP_WINDOW)
+    parser.add_argument('--record', dest='record_path', help="Record the SBS1 feed to compressed segment files named RECORD_PATH-<timestamp>.gz")
+    parser.add_argument('--replay', nargs='+', help="Play back recorded SBS1 files instead of connecting to dump1090")
+    parser.add_argument('--speed', type=recorder.parse_speed, help="Playback speed, eg. 1x, 10x or max (default 1x)", default=1)
     parser.add_argument('-pdb', '--planedb', dest='pdb_host', help="Plane database host")
+    parser.add_argument('-s', '--snapshot', help="Local snapshot of the plane database, read before asking the plane database host, or instead of it if there is none (see planestore.py)")
+    parser.add_argument('-w', '--workers', type=int, help="Number of threads doing plane database lookups and image searches (default %d)" % ENRICHMENT_WORKERS, default=ENRICHMENT_WORKERS)
+    parser.add_argument('-T', '--timeout', type=float, help="Forget aircraft not heard from in this many seconds (default %d)" % OBSERVATION_TIMEOUT, default=OBSERVATION_TIMEOUT)
+    parser.add_argument('--accuracy', type=float, help="Max error in meters of distances to aircraft within %d km, lower is slower (default %d)" % (GEODESY_RANGE / 1000, GEODESY_ACCURACY), default=GEODESY_ACCURACY)
     parser.add_argument('-x', '--prox', dest='prox_topic', help="MQTT proximity topic", default="/adsb/proximity/json")
+    parser.add_argument('-b', '--binary', dest='binary_topic', help="MQTT topic for binary proximity reports, eg. /adsb/proximity/bin (default none)")
+    parser.add_argument('--delta', action="store_true", help="Publish proximity reports as deltas of the fields that changed, with a full report when tracking changes and every --keyframe-interval seconds")
+    parser.add_argument('--keyframe-interval', type=float, help="Seconds between full proximity reports in delta mode (default %d)" % KEYFRAME_INTERVAL, default=KEYFRAME_INTERVAL)
     parser.add_argument('-n', '--unk', dest='unknown_topic', help="MQTT unknown aircraft topic", default="/adsb/unknown")
     parser.add_argument('-v', '--verbose',  action="store_true", help="Verbose output")
 
@@ -628,9 +1059,22 @@ def main():
 
     if args.pdb_host:
         planedb.init(args.pdb_host)
-
-    tracker = FlightTracker(args.dump1090_host, args.mqtt_host, args.lat, args.lon, args.prox_topic, dump1090_port = args.dump1090_port, mqtt_port = args.mqtt_port, unknown_aircraft_topic = args.unknown_topic)
-    tracker.run()  # Never returns
+    if args.snapshot:
+        planecache.use_store(PlaneStore(args.snapshot), refresh = bool(args.pdb_host), offline = not args.pdb_host)
+
+    if args.dedup_window is None:
+        # A single feed repeats itself for good reasons
+        args.dedup_window = DEDUP_WINDOW if args.feeds else 0
+    tracker = FlightTracker(args.dump1090_host, args.mqtt_host, args.lat, args.lon, args.prox_topic, dump1090_port = args.dump1090_port, mqtt_port = args.mqtt_port, unknown_aircraft_topic = args.unknown_topic, feeds = args.feeds, dedup_window = args.dedup_window, record_path = args.record_path, enrichment_workers = args.workers, geodesy_accuracy = args.accuracy, observation_timeout = args.timeout, binary_topic = args.binary_topic, keyframe_interval = args.keyframe_interval if args.delta else None)
+    # Shut down through the finally clause below when killed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        if args.replay:
+            tracker.replay(args.replay, args.speed)
+        else:
+            tracker.run()  # Never returns
+    finally:
+        tracker.close()
 
 
 # Ye ol main
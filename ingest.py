@@ -0,0 +1,250 @@
+#
+# Copyright (c) 2024 Johan Kanflo (github.com/kanflo)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+#
+# asyncio based ingest of several SBS1 feeds at once, eg. a couple of local
+# dump1090 receivers and the adsbhub feed. Each feed reconnects on its own
+# and all lines are handed to the same handler on the event loop thread.
+#
+# Running this file starts two local stand-in servers, one of which drops
+# the connection, and checks that all lines are received.
+#
+
+from typing import *
+import asyncio
+import logging
+import time
+from linereader import LineReader
+
+# Wait this long before reconnecting a feed
+RECONNECT_DELAY = 5
+# Reconnect a feed that has been silent this long
+FEED_READ_TIMEOUT = 60
+# Log feed counters this often
+STATS_INTERVAL = 60
+# Read size
+CHUNK_SIZE = 65536
+
+
+class Feed(object):
+    """
+    An SBS1 feed and its counters
+    """
+
+    def __init__(self, host: str, port: int, name: str = None):
+        """Create a feed
+
+        Arguments:
+            host {str} -- Name or IP of feed host
+            port {int} -- Feed port
+
+        Keyword Arguments:
+            name {str} -- Name used in logs (default: {host:port})
+        """
+        self.host = host
+        self.port = port
+        self.name = name if name else "%s:%d" % (host, port)
+        self.connected = False
+        self.connects = 0
+        self.disconnects = 0
+        self.messages = 0
+        self.dropped = 0
+
+    def __repr__(self) -> str:
+        return "%s (%s, %d messages, %d connects)" % (self.name, "up" if self.connected else "down", self.messages, self.connects)
+
+
+def parse_feed(spec: str) -> Feed:
+    """Parse a feed given as host:port
+
+    Arguments:
+        spec {str} -- Feed as host:port, the port defaults to 30003
+
+    Returns:
+        Feed -- The feed
+    """
+    (host, _, port) = spec.rpartition(":")
+    if not host:
+        return Feed(spec, 30003)
+    return Feed(host, int(port))
+
+
+class IngestEngine(object):
+    """
+    Read several SBS1 feeds concurrently
+    """
+
+    def __init__(self, feeds: List[Feed], handler: Callable[[bytes, Feed], None], reconnect_delay: float = RECONNECT_DELAY, read_timeout: float = FEED_READ_TIMEOUT, stats_interval: float = STATS_INTERVAL):
+        """Create an ingest engine
+
+        Arguments:
+            feeds {List[Feed]} -- Feeds to read
+            handler {Callable[[bytes, Feed], None]} -- Called for every line received, without line terminator
+
+        Keyword Arguments:
+            reconnect_delay {float} -- Seconds to wait before reconnecting (default: {RECONNECT_DELAY})
+            read_timeout {float} -- Reconnect a feed that has been silent this many seconds (default: {FEED_READ_TIMEOUT})
+            stats_interval {float} -- Log feed counters this often, 0 to disable (default: {STATS_INTERVAL})
+        """
+        self.__feeds = feeds
+        self.__handler = handler
+        self.__reconnect_delay = reconnect_delay
+        self.__read_timeout = read_timeout
+        self.__stats_interval = stats_interval
+        self.__tasks = []
+
+    def getFeeds(self) -> List[Feed]:
+        return self.__feeds
+
+    async def run(self):
+        """Read all feeds until stopped
+        """
+        self.__tasks = [asyncio.create_task(self.__read_feed(feed)) for feed in self.__feeds]
+        if self.__stats_interval:
+            self.__tasks.append(asyncio.create_task(self.__log_stats()))
+        try:
+            await asyncio.gather(*self.__tasks)
+        except asyncio.CancelledError:
+            pass
+
+    def stop(self):
+        """Stop reading, must be called from the event loop thread
+        """
+        for task in self.__tasks:
+            task.cancel()
+
+    async def __read_feed(self, feed: Feed):
+        """Read a feed, reconnecting when needed
+        """
+        has_nagged = False
+        while True:
+            try:
+                if not has_nagged:
+                    logging.info("Connecting to feed %s" % (feed.name))
+                (reader, writer) = await asyncio.open_connection(feed.host, feed.port)
+            except OSError as e:
+                if not has_nagged:
+                    logging.critical("Failed to connect to feed %s, retrying : %s" % (feed.name, e))
+                    has_nagged = True
+                await asyncio.sleep(self.__reconnect_delay)
+                continue
+            logging.info("Feed %s connected" % (feed.name))
+            has_nagged = False
+            feed.connected = True
+            feed.connects += 1
+            try:
+                await self.__read_lines(feed, reader)
+            except asyncio.TimeoutError:
+                logging.warning("Feed %s timed out" % (feed.name))
+            except OSError as e:
+                logging.warning("Feed %s socket error : %s" % (feed.name, e))
+            finally:
+                feed.connected = False
+                feed.disconnects += 1
+                writer.close()
+            await asyncio.sleep(self.__reconnect_delay)
+
+    async def __read_lines(self, feed: Feed, reader: asyncio.StreamReader):
+        """Hand lines to the handler until the peer closes the connection
+        """
+        framer = LineReader(None)
+        try:
+            while True:
+                chunk = await asyncio.wait_for(reader.read(CHUNK_SIZE), self.__read_timeout)
+                if not chunk:
+                    logging.warning("Feed %s closed" % (feed.name))
+                    return
+                for line in framer.feed(chunk):
+                    feed.messages += 1
+                    try:
+                        self.__handler(line, feed)
+                    except Exception:
+                        # A bad line must not take the feed, or the other feeds, down
+                        logging.error("Feed %s failed to handle %r" % (feed.name, line[:200]), exc_info = True)
+        finally:
+            feed.dropped += framer.dropped
+
+    async def __log_stats(self):
+        """Log feed counters now and then
+        """
+        last = {feed.name: 0 for feed in self.__feeds}
+        last_time = time.monotonic()
+        while True:
+            await asyncio.sleep(self.__stats_interval)
+            now = time.monotonic()
+            for feed in self.__feeds:
+                rate = (feed.messages - last[feed.name]) / (now - last_time)
+                last[feed.name] = feed.messages
+                logging.info("Feed %s : %s, %d messages (%.0f/s), %d connects" % (feed.name, "up" if feed.connected else "down", feed.messages, rate, feed.connects))
+            last_time = now
+
+
+async def _check():
+    """Run the engine against two local stand-in servers"""
+    lines = [b"MSG,3,1,1,4787B0,1,2024/03/01,12:00:01.012,2024/03/01,12:00:01.014,,17500,,,55.29126,13.33108,,,0,0,0,0",
+             b"MSG,4,1,1,4787B0,1,2024/03/01,12:00:01.345,2024/03/01,12:00:01.347,,,413,131,,,2240,,0,0,0,0"]
+
+    async def steady(reader, writer):
+        # Sends 1000 lines in small pieces and then waits for the client to hang up
+        data = b"".join(line + b"\r\n" for line in lines) * 500
+        for i in range(0, len(data), 1000):
+            writer.write(data[i:i + 1000])
+            await writer.drain()
+        await reader.read()
+        writer.close()
+
+    async def flaky(reader, writer):
+        # Sends 100 LF terminated lines and hangs up, every time
+        writer.write(b"".join(line + b"\n" for line in lines) * 50)
+        await writer.drain()
+        writer.close()
+
+    servers = [await asyncio.start_server(steady, "127.0.0.1", 0), await asyncio.start_server(flaky, "127.0.0.1", 0)]
+    feeds = [Feed("127.0.0.1", server.sockets[0].getsockname()[1]) for server in servers]
+    received = {feed.name: [] for feed in feeds}
+
+    def handler(line: bytes, feed: Feed):
+        received[feed.name].append(line)
+        if len(received[feed.name]) == 10:
+            raise ValueError("A handler failing on a line")
+
+    engine = IngestEngine(feeds, handler, reconnect_delay = 0.05, stats_interval = 0)
+    task = asyncio.create_task(engine.run())
+    await asyncio.sleep(1)
+    engine.stop()
+    await task
+    for server in servers:
+        server.close()
+    # Let the servers notice that we hung up
+    await asyncio.sleep(0.1)
+
+    assert received[feeds[0].name] == lines * 500, "Steady feed lost lines"
+    assert feeds[0].connects == 1
+    assert feeds[1].connects > 2, "Flaky feed did not reconnect"
+    assert received[feeds[1].name] == lines * 50 * feeds[1].connects, "Flaky feed lost lines"
+    assert feeds[1].messages == len(received[feeds[1].name])
+    print(feeds)
+
+
+if __name__ == "__main__":
+    asyncio.run(_check())
+    print("All good")
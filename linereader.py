@@ -0,0 +1,199 @@
+#
+# Copyright (c) 2024 Johan Kanflo (github.com/kanflo)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+#
+# Line framing for SBS1 feeds. Data is received straight into a reusable
+# buffer and complete lines are handed out as bytes, terminated by either
+# CRLF or LF. Partial lines stay in the buffer until the rest arrives.
+# Data read elsewhere, eg. from an asyncio stream, is framed with feed().
+#
+# Running this file feeds a local socket with adversarial chunk boundaries
+# and checks that the lines come out intact.
+#
+
+from typing import *
+import socket
+import logging
+
+# Initial size of the receive buffer
+BUFFER_SIZE = 16384
+# Lines longer than this are garbage and will be dropped
+MAX_LINE_LENGTH = 65536
+
+
+class LineReader(object):
+    """
+    Frame lines read from a socket
+    """
+
+    def __init__(self, sock: socket.socket|None, buffer_size: int = BUFFER_SIZE, max_line_length: int = MAX_LINE_LENGTH):
+        """Create a line reader
+
+        Arguments:
+            sock {socket.socket|None} -- Connected socket to read from, None if only feed() is used
+
+        Keyword Arguments:
+            buffer_size {int} -- Initial size of the receive buffer (default: {BUFFER_SIZE})
+            max_line_length {int} -- Lines longer than this are dropped (default: {MAX_LINE_LENGTH})
+        """
+        self.__sock = sock
+        self.__buffer = bytearray(buffer_size)
+        self.__view = memoryview(self.__buffer)
+        self.__max_line_length = max_line_length
+        self.__start = 0  # First byte not yet handed out as a line
+        self.__end = 0    # End of received data
+        self.__scan = 0   # Where to continue looking for LF
+        self.__discarding = False  # Skip data up to the next LF
+        self.dropped = 0  # Number of too long lines dropped
+
+    def fill(self) -> int:
+        """Receive more data from the socket. Socket exceptions are passed on to the caller.
+        Call lines() after each fill to hand out the lines received.
+
+        Returns:
+            int -- Number of bytes received, 0 if the peer closed the connection
+        """
+        if self.__end == len(self.__buffer):
+            self.__compact()
+        n = self.__sock.recv_into(self.__view[self.__end:])
+        self.__end += n
+        return n
+
+    def feed(self, data: bytes) -> Iterator[bytes]:
+        """Add data received elsewhere and return the lines it completes
+
+        Arguments:
+            data {bytes} -- The data
+
+        Yields:
+            bytes -- A line, without line terminators
+        """
+        data = memoryview(data)
+        while len(data) > 0:
+            if self.__end == len(self.__buffer):
+                self.__compact()
+            n = min(len(data), len(self.__buffer) - self.__end)
+            self.__view[self.__end:self.__end + n] = data[:n]
+            self.__end += n
+            data = data[n:]
+            yield from self.lines()
+
+    def lines(self) -> Iterator[bytes]:
+        """Return the complete lines received so far, without line terminators
+
+        Yields:
+            bytes -- A line
+        """
+        buffer = self.__buffer
+        while True:
+            lf = buffer.find(b"\n", self.__scan, self.__end)
+            if lf < 0:
+                self.__scan = self.__end
+                return
+            stop = lf
+            if stop > self.__start and buffer[stop - 1] == 0x0d:
+                stop -= 1
+            line = bytes(self.__view[self.__start:stop])
+            self.__start = self.__scan = lf + 1
+            if self.__discarding:
+                self.__discarding = False
+                continue
+            yield line
+
+    def __compact(self):
+        """Make room at the end of the buffer by moving the pending partial line
+        to the front, growing the buffer if the partial line fills it
+        """
+        pending = self.__end - self.__start
+        if pending == len(self.__buffer):
+            if pending >= self.__max_line_length:
+                logging.warning("Dropping %d bytes without line ending" % (pending))
+                self.dropped += 1
+                self.__start = self.__end = self.__scan = 0
+                self.__discarding = True
+                return
+            self.__view.release()
+            self.__buffer.extend(bytes(len(self.__buffer)))
+            self.__view = memoryview(self.__buffer)
+        elif pending > 0:
+            self.__view[:pending] = self.__view[self.__start:self.__end]
+        self.__scan -= self.__start
+        self.__start = 0
+        self.__end = pending
+
+
+def _check(chunks: List[bytes], expected: List[bytes], buffer_size: int, max_line_length: int = MAX_LINE_LENGTH):
+    """Send chunks over a local socket pair and verify the lines read back"""
+    (rx, tx) = socket.socketpair()
+    reader = LineReader(rx, buffer_size = buffer_size, max_line_length = max_line_length)
+    received = []
+    try:
+        for chunk in chunks:
+            tx.sendall(chunk)
+            # Make sure each chunk shows up in a recv of its own
+            while len(chunk) > 0:
+                n = reader.fill()
+                assert n > 0
+                chunk = chunk[n:]
+                received.extend(reader.lines())
+        tx.close()
+        while reader.fill() > 0:
+            received.extend(reader.lines())
+    finally:
+        rx.close()
+        tx.close()
+    assert received == expected, "%s != %s" % (received, expected)
+    # The same chunks through feed()
+    reader = LineReader(None, buffer_size = buffer_size, max_line_length = max_line_length)
+    received = [line for chunk in chunks for line in reader.feed(chunk)]
+    assert received == expected, "feed(): %s != %s" % (received, expected)
+
+
+if __name__ == "__main__":
+    lines = [
+        b"MSG,3,1,1,4787B0,1,2024/03/01,12:00:01.012,2024/03/01,12:00:01.014,,17500,,,55.29126,13.33108,,,0,0,0,0",
+        b"MSG,4,1,1,4787B0,1,2024/03/01,12:00:01.345,2024/03/01,12:00:01.347,,,413,131,,,2240,,0,0,0,0",
+        b"",
+        b"MSG,1,1,1,4CA7B5,1,2024/03/01,12:00:00.123,2024/03/01,12:00:00.125,RYR4TX  ,,,,,,,,,,,0",
+    ]
+    crlf = b"".join(line + b"\r\n" for line in lines)
+    lf = b"".join(line + b"\n" for line in lines)
+    mixed = lines[0] + b"\r\n" + lines[1] + b"\n" + lines[2] + b"\n" + lines[3] + b"\r\n"
+
+    for data in (crlf, lf, mixed):
+        for buffer_size in (8, 64, BUFFER_SIZE):
+            # Every possible split in two
+            for i in range(len(data) + 1):
+                _check([data[:i], data[i:]], lines, buffer_size)
+            # One byte at a time
+            _check([data[i:i + 1] for i in range(len(data))], lines, buffer_size)
+            # Split right between CR and LF
+            for i in range(len(data)):
+                if data[i:i + 1] == b"\r":
+                    _check([data[:i + 1], data[i + 1:]], lines, buffer_size)
+
+    # A partial line at EOF is not a line
+    _check([crlf + b"MSG,3,1"], lines, 64)
+    # Long lines are fine up to the limit, beyond that they are dropped
+    _check([b"x" * 300, b"\n" + crlf], [b"x" * 300] + lines, 64)
+    _check([b"x" * 300, b"\n" + crlf], lines, 64, max_line_length = 256)
+    print("All good")
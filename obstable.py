@@ -0,0 +1,119 @@
+#
+# Copyright (c) 2024 Johan Kanflo (github.com/kanflo)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+#
+# Column store for observations. Every aircraft gets a slot, a row index
+# into one array per field, and flighttracker.Observation is a view of a
+# slot. Numeric fields are unboxed doubles in array.array columns, NaN
+# meaning "not received yet", which keeps a global feed small and lets the
+# columns be handed to NumPy for fleet wide queries. Slots of aircraft that
+# are gone are reused.
+#
+# Timestamps are time.monotonic() seconds.
+#
+
+from typing import *
+import math
+import time
+from array import array
+import numpy as np
+
+# Columns of doubles, NaN if not known
+NUMERIC_COLUMNS = ("altitude", "groundSpeed", "track", "lat", "lon", "verticalRate", "seen", "altitudeTime", "latLonTime", "aircraftRetry", "routeRetry")
+# Columns of Python objects, None if not known
+OBJECT_COLUMNS = ("icao24", "callsign", "operator", "registration", "type", "route", "route_json", "image_url")
+
+NAN = math.nan
+
+
+class ObservationTable(object):
+    """
+    Observations as a structure of arrays, indexed by slot
+    """
+
+    def __init__(self):
+        for name in NUMERIC_COLUMNS:
+            setattr(self, name, array("d"))
+        for name in OBJECT_COLUMNS:
+            setattr(self, name, [])
+        self.flags = array("B")  # Observation.FLAG_* bits
+        self.dirty = array("q")  # DIRTY_* bits of the fields changed since Observation.clearDirty
+        self.__free = []
+        # time.time() at time.monotonic() zero, for turning slot times into dates
+        self.epoch = time.time() - time.monotonic()
+
+    def allocate(self) -> int:
+        """Return an empty slot, reusing a freed one if there is one
+        """
+        if self.__free:
+            return self.__free.pop()
+        for name in NUMERIC_COLUMNS:
+            getattr(self, name).append(NAN)
+        for name in OBJECT_COLUMNS:
+            getattr(self, name).append(None)
+        self.flags.append(0)
+        self.dirty.append(0)
+        return len(self.flags) - 1
+
+    def free(self, slot: int):
+        """Clear a slot and put it on the free list
+        """
+        for name in NUMERIC_COLUMNS:
+            getattr(self, name)[slot] = NAN
+        for name in OBJECT_COLUMNS:
+            getattr(self, name)[slot] = None
+        self.flags[slot] = 0
+        self.dirty[slot] = 0
+        self.__free.append(slot)
+
+    def __len__(self) -> int:
+        """Return the number of slots in use
+        """
+        return len(self.flags) - len(self.__free)
+
+    def getCapacity(self) -> int:
+        """Return the number of slots, used or free
+        """
+        return len(self.flags)
+
+    def column(self, name: str, slots: np.ndarray|None = None) -> np.ndarray:
+        """Return a numeric column as a NumPy array
+
+        Arguments:
+            name {str} -- One of NUMERIC_COLUMNS
+
+        Keyword Arguments:
+            slots {np.ndarray} -- Only these slots (default: {None})
+
+        Returns:
+            np.ndarray -- A copy of the column, NaN for unknown values and free slots
+        """
+        # The view must not outlive this call, the array cannot grow while it is exported
+        view = np.frombuffer(getattr(self, name), dtype=np.float64)
+        values = view[slots] if slots is not None else view.copy()
+        del view
+        return values
+
+    def getUsedSlots(self) -> np.ndarray:
+        """Return the slots in use
+        """
+        return np.array([slot for (slot, icao24) in enumerate(self.icao24) if icao24 is not None], dtype=np.intp)
@@ -0,0 +1,325 @@
+#
+# Copyright (c) 2024 Johan Kanflo (github.com/kanflo)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+#
+# Process wide cache in front of the plane database. Every lookup used to
+# be a round trip to the planedb server, now only the first one is. Unknown
+# aircraft, routes and airports are cached too, for a shorter while.
+#
+# The cached objects are shared, do not modify them.
+#
+# With use_store() the cache is backed by a local snapshot of the plane
+# database (see planestore.py) that is read before asking the server.
+#
+
+from typing import *
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import planedb
+
+# Max number of entries in each cache
+CACHE_SIZE = 20000
+# Seconds to keep entries found in the database
+AIRCRAFT_TTL = 3600
+ROUTE_TTL = 3600
+AIRPORT_TTL = 24 * 3600
+# Seconds to remember entries not found in the database
+NEGATIVE_TTL = 300
+# Max number of concurrent requests when looking up a batch of aircraft
+BATCH_CONCURRENCY = 16
+
+# Marks a cached "not found"
+_NOT_FOUND = object()
+
+
+class TTLCache(object):
+    """
+    A size bounded LRU cache with expiring entries
+    """
+
+    def __init__(self, name: str, max_size: int = CACHE_SIZE, ttl: float = AIRCRAFT_TTL, negative_ttl: float = NEGATIVE_TTL):
+        """Create a cache
+
+        Arguments:
+            name {str} -- Name used when logging statistics
+
+        Keyword Arguments:
+            max_size {int} -- Max number of entries, the least recently used one is evicted (default: {CACHE_SIZE})
+            ttl {float} -- Seconds to keep found entries (default: {AIRCRAFT_TTL})
+            negative_ttl {float} -- Seconds to remember that an entry was not found (default: {NEGATIVE_TTL})
+        """
+        self.name = name
+        self.__max_size = max_size
+        self.__ttl = ttl
+        self.__negative_ttl = negative_ttl
+        self.__entries = OrderedDict()  # key -> (expiry time, value)
+        self.__lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable, loader: Callable[[Hashable], Any]) -> Any:
+        """Return cached value for key, calling loader(key) on a miss
+
+        Arguments:
+            key {Hashable} -- Key to look up
+            loader {Callable} -- Returns the value for key or None if not found
+
+        Returns:
+            Any -- The value or None if not found
+        """
+        now = time.monotonic()
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self.__entries.move_to_end(key)
+                    if entry[1] is _NOT_FOUND:
+                        self.negative_hits += 1
+                        return None
+                    self.hits += 1
+                    return entry[1]
+                del self.__entries[key]
+                self.expirations += 1
+            self.misses += 1
+        # Do not hold the lock during the round trip
+        value = loader(key)
+        self.put(key, value)
+        return value
+
+    def put(self, key: Hashable, value: Any):
+        """Store value for key, None means not found
+        """
+        now = time.monotonic()
+        with self.__lock:
+            if value is None:
+                self.__entries[key] = (now + self.__negative_ttl, _NOT_FOUND)
+            else:
+                self.__entries[key] = (now + self.__ttl, value)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.__max_size:
+                self.__entries.popitem(last=False)
+                self.evictions += 1
+
+    def peek(self, key: Hashable) -> Tuple[bool, Any]:
+        """Look up key without calling the loader
+
+        Returns:
+            Tuple[bool, Any] -- (True, value) if cached, value is None for a cached "not found", otherwise (False, None)
+        """
+        now = time.monotonic()
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None or entry[0] <= now:
+                return (False, None)
+            self.__entries.move_to_end(key)
+            return (True, None if entry[1] is _NOT_FOUND else entry[1])
+
+    def invalidate(self, key: Hashable):
+        """Forget key, eg. after it was updated in the database
+        """
+        with self.__lock:
+            self.__entries.pop(key, None)
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def getHitRate(self) -> float:
+        """Return the fraction of lookups answered from the cache
+        """
+        lookups = self.hits + self.negative_hits + self.misses
+        if lookups == 0:
+            return 0
+        return (self.hits + self.negative_hits) / lookups
+
+    def stats(self) -> str:
+        """Return the cache statistics as a string for logging
+        """
+        return "%s cache: %d entries, %d hits, %d negative hits, %d misses (%.1f%% hit rate), %d evictions, %d expirations" % \
+            (self.name, len(self), self.hits, self.negative_hits, self.misses, 100 * self.getHitRate(), self.evictions, self.expirations)
+
+
+class AirportIndex(object):
+    """
+    Airports by IATA code, kept for good as airports rarely change. Entries
+    are sanitized for publishing and serialized once, when first looked up
+    or when loaded from the snapshot.
+    """
+
+    def __init__(self):
+        self.__airports = {}  # iata -> (airport, json)
+        self.__lock = threading.Lock()
+
+    def get(self, iata: str) -> Tuple[dict, str]|None:
+        """Return an airport and its JSON representation
+
+        Arguments:
+            iata {str} -- IATA code
+
+        Returns:
+            Tuple[dict, str]|None -- The airport and its JSON or None if not known. The airport is shared, do not modify it.
+        """
+        entry = self.__airports.get(iata)
+        if entry is None:
+            airport = lookup_airport(iata)
+            if not airport:
+                return None
+            entry = self.add(iata, airport)
+        return entry
+
+    def add(self, iata: str, airport: dict) -> Tuple[dict, str]:
+        """Sanitize and add an airport
+        """
+        airport = dict(airport)
+        airport.pop('id', None)
+        airport.pop('added_on', None)
+        airport.pop('updated_on', None)
+        entry = (airport, json.dumps(airport, default = str))
+        with self.__lock:
+            self.__airports[iata] = entry
+        return entry
+
+    def load(self, store: "planestore.PlaneStore"):
+        """Add all airports in a snapshot
+        """
+        for (iata, airport) in store.getAll("airport"):
+            self.add(iata, airport)
+        logging.info("Loaded %d airports from snapshot" % (len(self)))
+
+    def invalidate(self, iata: str):
+        with self.__lock:
+            self.__airports.pop(iata, None)
+
+    def __len__(self) -> int:
+        return len(self.__airports)
+
+
+_batch_executor = None
+_store = None
+_offline = False
+
+aircraft_cache = TTLCache("Aircraft", ttl = AIRCRAFT_TTL)
+route_cache = TTLCache("Route", ttl = ROUTE_TTL)
+airport_cache = TTLCache("Airport", ttl = AIRPORT_TTL)
+airport_index = AirportIndex()
+
+
+def use_store(store: "planestore.PlaneStore", refresh: bool = True, offline: bool = False):
+    """Read from a local snapshot of the plane database before asking the server
+
+    Arguments:
+        store {PlaneStore} -- The snapshot
+
+    Keyword Arguments:
+        refresh {bool} -- Refresh stale snapshot entries from the server in the background (default: {True})
+        offline {bool} -- There is no server, entries not in the snapshot are not found (default: {False})
+    """
+    global _store, _offline
+    _store = store
+    _offline = offline
+    airport_index.load(store)
+    if refresh:
+        def refreshed(table: str, key: str):
+            caches[table].invalidate(key)
+            if table == "airport":
+                airport_index.invalidate(key)
+
+        caches = {"aircraft": aircraft_cache, "route": route_cache, "airport": airport_cache}
+        store.startRefresh({"aircraft": planedb.lookup_aircraft_icao24, "route": planedb.lookup_route, "airport": planedb.lookup_airport}, refreshed)
+
+
+def __load(table: str, fetch: Callable[[str], Any], key: str) -> Any:
+    """Load an entry from the snapshot, or from the server if not in the snapshot"""
+    if _store is None:
+        return fetch(key)
+    (found, value) = _store.get(table, key)
+    if found or _offline:
+        return value
+    value = fetch(key)
+    _store.put(table, key, value)
+    return value
+
+
+def lookup_aircraft_icao24(icao24: str) -> dict|None:
+    """Cached planedb.lookup_aircraft_icao24
+    """
+    return aircraft_cache.get(icao24, lambda key: __load("aircraft", planedb.lookup_aircraft_icao24, key))
+
+
+def lookup_aircraft_icao24_batch(icao24s: List[str]) -> Dict[str, dict|None]:
+    """Look up a batch of aircraft. planedb has no bulk lookup, so the ones
+    not in the cache are requested concurrently.
+
+    Arguments:
+        icao24s {List[str]} -- Aircraft to look up
+
+    Returns:
+        Dict[str, dict|None] -- Aircraft per icao24, None if not found. Failed lookups are left out.
+    """
+    global _batch_executor
+    if _batch_executor is None:
+        _batch_executor = ThreadPoolExecutor(max_workers = BATCH_CONCURRENCY, thread_name_prefix = "PlaneDB")
+
+    def lookup(icao24: str):
+        try:
+            return (icao24, True, lookup_aircraft_icao24(icao24))
+        except Exception:
+            logging.error("Lookup of %s failed" % (icao24), exc_info = True)
+            return (icao24, False, None)
+
+    result = {}
+    for (icao24, ok, plane) in _batch_executor.map(lookup, icao24s):
+        if ok:
+            result[icao24] = plane
+    return result
+
+
+def lookup_route(callsign: str) -> dict|None:
+    """Cached planedb.lookup_route
+    """
+    return route_cache.get(callsign, lambda key: __load("route", planedb.lookup_route, key))
+
+
+def lookup_airport(iata: str) -> dict|None:
+    """Cached planedb.lookup_airport
+    """
+    return airport_cache.get(iata, lambda key: __load("airport", planedb.lookup_airport, key))
+
+
+def log_stats():
+    """Log statistics of all caches
+    """
+    for cache in (aircraft_cache, route_cache, airport_cache):
+        logging.info(cache.stats())
+    logging.info("Airport index: %d airports" % (len(airport_index)))
+    if _store:
+        logging.info(_store.stats())
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2024 Johan Kanflo (github.com/kanflo)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+#
+# Local snapshot of the plane database in an SQLite file. The tracker reads
+# aircraft, routes and airports from the snapshot first and only asks the
+# planedb server about entries it has never seen, so it keeps working when
+# the server is slow or unreachable. Entries older than a day are refreshed
+# from the server in the background, a few at a time.
+#
+# The planedb server has no way of listing its tables, the snapshot is
+# filled by the lookups the tracker makes. To seed a snapshot from recorded
+# traffic:
+#
+#   % ./planestore.py -pdb planedb.local -s planedb.sqlite adsb-20240301-*.gz
+#
+
+from typing import *
+import json
+import time
+import sqlite3
+import logging
+import argparse
+import threading
+
+# The snapshot tables
+TABLES = ("aircraft", "route", "airport")
+# Refresh entries older than this many seconds
+REFRESH_AGE = 24 * 3600
+# Look for stale entries this often
+REFRESH_INTERVAL = 60
+# Max number of entries refreshed each time
+REFRESH_BATCH = 100
+
+
+class PlaneStore(object):
+    """
+    An SQLite snapshot of the plane database, safe to use from several threads
+    """
+
+    def __init__(self, path: str, refresh_age: float = REFRESH_AGE):
+        """Open or create a snapshot
+
+        Arguments:
+            path {str} -- Snapshot file
+
+        Keyword Arguments:
+            refresh_age {float} -- Entries older than this many seconds are stale (default: {REFRESH_AGE})
+        """
+        self.__path = path
+        self.__refresh_age = refresh_age
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(path, check_same_thread = False, isolation_level = None)
+        self.__db.execute("PRAGMA journal_mode = WAL")
+        self.__db.execute("PRAGMA synchronous = NORMAL")
+        for table in TABLES:
+            # The key is the primary key of a rowid-less table, so a lookup is a single index search
+            self.__db.execute("CREATE TABLE IF NOT EXISTS %s (key TEXT PRIMARY KEY, data TEXT, updated REAL NOT NULL) WITHOUT ROWID" % (table))
+            self.__db.execute("CREATE INDEX IF NOT EXISTS %s_updated ON %s (updated)" % (table, table))
+        self.__refresher = None
+        self.hits = 0
+        self.misses = 0
+        self.refreshed = 0
+
+    def get(self, table: str, key: str) -> Tuple[bool, Any]:
+        """Look up an entry
+
+        Arguments:
+            table {str} -- One of TABLES
+            key {str} -- icao24, callsign or IATA code
+
+        Returns:
+            Tuple[bool, Any] -- (True, value) if in the snapshot, value is None if known not to exist, otherwise (False, None)
+        """
+        with self.__lock:
+            row = self.__db.execute("SELECT data FROM %s WHERE key = ?" % (table), (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return (False, None)
+            self.hits += 1
+        return (True, None if row[0] is None else json.loads(row[0]))
+
+    def put(self, table: str, key: str, value: Any):
+        """Store an entry, None means it does not exist in the plane database
+        """
+        data = None if value is None else json.dumps(dict(value), default = str)
+        with self.__lock:
+            self.__db.execute("INSERT OR REPLACE INTO %s (key, data, updated) VALUES (?, ?, ?)" % (table), (key, data, time.time()))
+
+    def getStale(self, table: str, limit: int = REFRESH_BATCH) -> List[str]:
+        """Return the keys of the oldest entries that need refreshing
+        """
+        with self.__lock:
+            rows = self.__db.execute("SELECT key FROM %s WHERE updated < ? ORDER BY updated LIMIT ?" % (table), (time.time() - self.__refresh_age, limit)).fetchall()
+        return [row[0] for row in rows]
+
+    def getAll(self, table: str) -> List[Tuple[str, Any]]:
+        """Return all entries of a table that exist in the plane database
+        """
+        with self.__lock:
+            rows = self.__db.execute("SELECT key, data FROM %s WHERE data IS NOT NULL" % (table)).fetchall()
+        return [(key, json.loads(data)) for (key, data) in rows]
+
+    def count(self, table: str) -> int:
+        with self.__lock:
+            return self.__db.execute("SELECT COUNT(*) FROM %s" % (table)).fetchone()[0]
+
+    def startRefresh(self, fetchers: Dict[str, Callable[[str], Any]], refreshed: Callable[[str, str], None] = None, interval: float = REFRESH_INTERVAL):
+        """Refresh stale entries from the plane database in a background thread
+
+        Arguments:
+            fetchers {Dict[str, Callable[[str], Any]]} -- Plane database lookup for each table
+
+        Keyword Arguments:
+            refreshed {Callable[[str, str], None]} -- Called with table and key after an entry has been refreshed (default: {None})
+            interval {float} -- Look for stale entries this often (default: {REFRESH_INTERVAL})
+        """
+        if self.__refresher:
+            return
+        self.__refresher = threading.Thread(target = self.__refresh_thread, args = (fetchers, refreshed, interval), name = "PlaneStore", daemon = True)
+        self.__refresher.start()
+
+    def stats(self) -> str:
+        """Return the snapshot statistics as a string for logging
+        """
+        return "Snapshot %s: %s, %d hits, %d misses, %d refreshed" % \
+            (self.__path, ", ".join("%d %s" % (self.count(table), table) for table in TABLES), self.hits, self.misses, self.refreshed)
+
+    def __refresh_thread(self, fetchers: Dict[str, Callable[[str], Any]], refreshed: Callable[[str, str], None], interval: float):
+        while True:
+            for (table, fetch) in fetchers.items():
+                for key in self.getStale(table):
+                    try:
+                        value = fetch(key)
+                    except Exception as e:
+                        # Probably unreachable, keep what we have and try again later
+                        logging.warning("Failed to refresh %s %s : %s" % (table, key, e))
+                        break
+                    self.put(table, key, value)
+                    self.refreshed += 1
+                    if refreshed:
+                        refreshed(table, key)
+            time.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Seed a plane database snapshot with the aircraft and routes seen in SBS1 recordings')
+    parser.add_argument('-pdb', '--planedb', dest='pdb_host', help="Plane database host", required=True)
+    parser.add_argument('-s', '--snapshot', help="Snapshot file", required=True)
+    parser.add_argument('recordings', nargs='+', help="Recorded SBS1 files")
+    args = parser.parse_args()
+    logging.basicConfig(level = logging.INFO)
+
+    import planedb
+    import planecache
+    import recorder
+    import sbs1
+    planedb.init(args.pdb_host)
+    planecache.use_store(PlaneStore(args.snapshot), refresh = False)
+    icao24s = set()
+    callsigns = set()
+    for line in recorder.replay(args.recordings, speed = 0):
+        msg = sbs1.parse(line)
+        if msg:
+            icao24s.add(msg["icao24"])
+            if msg["callsign"]:
+                callsigns.add(msg["callsign"])
+    icao24s.discard(None)
+    icao24s.discard("000000")
+    logging.info("Looking up %d aircraft and %d routes" % (len(icao24s), len(callsigns)))
+    planecache.lookup_aircraft_icao24_batch(sorted(icao24s))
+    for callsign in sorted(callsigns):
+        route = planecache.lookup_route(callsign)
+        if route:
+            planecache.lookup_airport(route['src_iata'])
+            planecache.lookup_airport(route['dst_iata'])
+    planecache.log_stats()
+
+
+# Ye ol main
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,490 @@
+#
+# Copyright (c) 2024 Johan Kanflo (github.com/kanflo)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+#
+# The proximity reports flighttracker.py publishes. proximity_payload() is
+# the report as a dict and json.dumps() of it is the JSON published.
+# JSONSerializer produces the same bytes without building the dict: the
+# fields that rarely change (operator, registration, type, callsign, route
+# and image) are serialized once per aircraft into a format string and only
+# the position, distance and times are filled in for each report.
+#
+# For displays that would rather not parse JSON there is a fixed layout
+# binary encoding of the same report, little endian and packed:
+#
+#   offset  type      field
+#        0  uint8     version, BINARY_VERSION
+#        1  uint8     flags, BINARY_HAS_* bits
+#        2  uint32    counter
+#        6  uint32    time, seconds since 1970
+#       10  uint32    icao24, string id if BINARY_ICAO24_STRING
+#       14  int32     lat, 1e-5 degrees
+#       18  int32     lon, 1e-5 degrees
+#       22  uint32    distance, meters
+#       26  int32     altitude, feet
+#       30  uint16    speed, knots
+#       32  uint16    heading, degrees
+#       34  uint16    bearing, degrees
+#       36  int16     vspeed, feet/minute
+#       38  uint32    loggedDate, seconds since 1970
+#       42  uint32    loggedDate, microseconds
+#       46  uint16    operator, string id
+#       48  uint16    type, string id
+#       50  uint16    image, string id
+#       52  uint16    route origin, string id
+#       54  uint16    route destination, string id
+#       56  char[8]   registration, NUL padded
+#       64  char[8]   callsign, NUL padded
+#       72
+#
+# String id 0 is null. Other ids are sent once as retained messages on
+# <binary topic>/strings/<id> holding the UTF-8 string, airports as their
+# JSON. An icao24 that is not six hex digits, eg. a TIS-B address like
+# ~ABCDEF, is sent as a string too. The strings are published before the
+# reports using them, but MQTT does not order messages on different topics,
+# so a report may arrive before its strings. Subscribers treat an id they
+# do not have as not known (yet). decode_binary() is the reference decoder.
+#
+# In delta mode (DeltaEncoder) a full report, a keyframe, is sent when the
+# tracked aircraft changes and every KEYFRAME_INTERVAL seconds. The reports
+# in between only have the fields that changed since the report before,
+# along with "icao24", "counter" and "delta": true. The counter goes up by
+# one for each report, a subscriber that finds a gap publishes anything on
+# <proximity topic>/keyframe to get a keyframe. DeltaDecoder is the
+# reference decoder.
+#
+# Reports are made from flighttracker.ObservationSnapshot, where unknown
+# numbers are NaN.
+#
+# Running this file checks JSONSerializer against json.dumps, the binary
+# encoding against the JSON report and delta decoding against full reports.
+#
+
+from typing import *
+import json
+import struct
+import calendar
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+# Number of aircraft JSONSerializer keeps the serialized static fields of
+JSON_CACHE_SIZE = 64
+# Decimals of the published coordinates and distance
+COORDINATE_DECIMALS = 5
+# Layout of the binary report, see above
+BINARY_FORMAT = struct.Struct("<BBIIIiiIiHHHhIIHHHHH8s8s")
+BINARY_VERSION = 1
+# Binary report flags
+BINARY_HAS_VSPEED = 1 << 0
+BINARY_HAS_ROUTE = 1 << 1  # Route looked up, published as {} if the ids are 0
+BINARY_HAS_REGISTRATION = 1 << 2
+BINARY_ICAO24_STRING = 1 << 3  # The icao24 field is a string id
+# Digits of an icao24 that fits the icao24 field
+HEX_DIGITS = "0123456789abcdefABCDEF"
+# Max number of strings with an id, the least recently used id is reused when all are taken
+STRING_TABLE_SIZE = 65535
+# Seconds between keyframes in delta mode
+KEYFRAME_INTERVAL = 10
+# Fields of every delta report
+DELTA_FIELDS = ("icao24", "counter")
+
+
+def proximity_payload(snapshot: "flighttracker.ObservationSnapshot", bearing: float, distance: float, now: float, counter: int) -> dict:
+    """Return a proximity report
+
+    Arguments:
+        snapshot {ObservationSnapshot} -- The aircraft
+        bearing {float} -- Bearing to the aircraft in degrees
+        distance {float} -- Distance to the aircraft in meters
+        now {float} -- time.time()
+        counter {int} -- Report number
+
+    Returns:
+        dict -- The report, json.dumps() of it is what is published
+    """
+    vspeed = snapshot.verticalRate
+    return {
+        "vspeed": int(vspeed) if vspeed == vspeed else None,
+        "time": int(now),
+        "lat": round(snapshot.lat, COORDINATE_DECIMALS),
+        "lon": round(snapshot.lon, COORDINATE_DECIMALS),
+        "distance": round(distance / 1000, COORDINATE_DECIMALS),
+        "image": snapshot.image_url,
+        "altitude": int(snapshot.altitude),
+        "speed": int(snapshot.groundSpeed),
+        "icao24": snapshot.icao24,
+        "registration": snapshot.registration,
+        "heading": int(snapshot.track),
+        "operator": snapshot.operator,
+        "bearing": int(bearing),
+        "loggedDate": "%s" % (datetime.utcfromtimestamp(snapshot.date)),
+        "type": snapshot.type,
+        "callsign": snapshot.callsign if snapshot.callsign is not None else "",
+        "route": snapshot.route if snapshot.route is not None else "",
+        "counter": counter,
+    }
+
+
+class JSONSerializer(object):
+    """
+    Serializes proximity reports to the same bytes as json.dumps(proximity_payload(...)).
+    Not thread safe, use one per publishing thread.
+    """
+
+    def __init__(self, cache_size: int = JSON_CACHE_SIZE):
+        """Create a serializer
+
+        Keyword Arguments:
+            cache_size {int} -- Number of aircraft to keep the serialized static fields of (default: {JSON_CACHE_SIZE})
+        """
+        self.__cache_size = cache_size
+        self.__entries = OrderedDict()  # icao24 -> [static fields, format string, date, serialized date]
+        self.hits = 0
+        self.misses = 0
+
+    def json(self, snapshot: "flighttracker.ObservationSnapshot", bearing: float, distance: float, now: float, counter: int) -> str:
+        """Return json.dumps(proximity_payload(snapshot, bearing, distance, now, counter))
+        """
+        static = (snapshot.icao24, snapshot.image_url, snapshot.registration, snapshot.operator, snapshot.type, snapshot.callsign,
+                  None if snapshot.route is None else snapshot.route_json)
+        entry = self.__entries.get(snapshot.icao24)
+        if entry is None or entry[0] != static:
+            self.misses += 1
+            entry = [static, self.__format(snapshot), None, None]
+            self.__entries[snapshot.icao24] = entry
+            if len(self.__entries) > self.__cache_size:
+                self.__entries.popitem(last=False)
+        else:
+            self.hits += 1
+            self.__entries.move_to_end(snapshot.icao24)
+        if entry[2] != snapshot.date:
+            entry[2] = snapshot.date
+            entry[3] = json.dumps("%s" % (datetime.utcfromtimestamp(snapshot.date)))
+        vspeed = snapshot.verticalRate
+        # %r of a float is float.__repr__, as used by json.dumps
+        return entry[1] % ("%d" % vspeed if vspeed == vspeed else "null", now, round(snapshot.lat, COORDINATE_DECIMALS), round(snapshot.lon, COORDINATE_DECIMALS),
+                           round(distance / 1000, COORDINATE_DECIMALS), snapshot.altitude, snapshot.groundSpeed, snapshot.track, bearing, entry[3], counter)
+
+    @staticmethod
+    def __format(snapshot: "flighttracker.ObservationSnapshot") -> str:
+        """Return the report as a format string with the static fields filled in"""
+        def static(value: Any) -> str:
+            return json.dumps(value).replace("%", "%%")
+
+        route = "\"\"" if snapshot.route is None else snapshot.route_json.replace("%", "%%")
+        callsign = snapshot.callsign if snapshot.callsign is not None else ""
+        return '{"vspeed": %s, "time": %d, "lat": %r, "lon": %r, "distance": %r, "image": ' + static(snapshot.image_url) + \
+            ', "altitude": %d, "speed": %d, "icao24": ' + static(snapshot.icao24) + ', "registration": ' + static(snapshot.registration) + \
+            ', "heading": %d, "operator": ' + static(snapshot.operator) + ', "bearing": %d, "loggedDate": %s, "type": ' + static(snapshot.type) + \
+            ', "callsign": ' + static(callsign) + ', "route": ' + route + ', "counter": %d}'
+
+
+class StringTable(object):
+    """
+    Strings by id, for the binary reports
+    """
+
+    def __init__(self, max_size: int = STRING_TABLE_SIZE):
+        """Create an empty table
+
+        Keyword Arguments:
+            max_size {int} -- Max number of ids, at most 65535 (default: {STRING_TABLE_SIZE})
+        """
+        self.__max_size = max_size
+        self.__ids = OrderedDict()  # string -> id, least recently used first
+
+    def intern(self, string: str|None, new: List[Tuple[int, str]]) -> int:
+        """Return the id of a string, giving it one if needed
+
+        Arguments:
+            string {str|None} -- The string, None gives 0
+            new {List[Tuple[int, str]]} -- (id, string) is added to this list if the string got a new id
+
+        Returns:
+            int -- The id
+        """
+        if string is None:
+            return 0
+        id = self.__ids.get(string)
+        if id is not None:
+            self.__ids.move_to_end(string)
+            return id
+        if len(self.__ids) < self.__max_size:
+            id = len(self.__ids) + 1
+        else:
+            (_, id) = self.__ids.popitem(last=False)
+        self.__ids[string] = id
+        new.append((id, string))
+        return id
+
+    def __len__(self) -> int:
+        return len(self.__ids)
+
+
+class BinaryEncoder(object):
+    """
+    Encodes proximity reports in the binary layout. Not thread safe, use one per publishing thread.
+    """
+
+    def __init__(self, strings: StringTable = None):
+        """Create an encoder
+
+        Keyword Arguments:
+            strings {StringTable} -- Intern the strings in this table (default: {None})
+        """
+        self.strings = strings if strings is not None else StringTable()
+        # Airports and logged date of the last report, the same for most reports
+        self.__route = (None, None, None)  # route_json, origin json, destination json
+        self.__date = (None, 0, 0)  # date, seconds, microseconds
+
+    def encode(self, snapshot: "flighttracker.ObservationSnapshot", bearing: float, distance: float, now: float, counter: int) -> Tuple[bytes, List[Tuple[int, str]]]:
+        """Encode the report proximity_payload(snapshot, bearing, distance, now, counter) describes
+
+        Returns:
+            Tuple[bytes, List[Tuple[int, str]]] -- The report and the strings given new ids, to be published before the report
+        """
+        new = []
+        intern = self.strings.intern
+        flags = 0
+        vspeed = snapshot.verticalRate
+        if vspeed == vspeed:
+            flags |= BINARY_HAS_VSPEED
+        else:
+            vspeed = 0
+        (origin, destination) = (0, 0)
+        if snapshot.route is not None:
+            flags |= BINARY_HAS_ROUTE
+            if snapshot.route:
+                if self.__route[0] != snapshot.route_json:
+                    self.__route = (snapshot.route_json, json.dumps(snapshot.route["origin"], default = str), json.dumps(snapshot.route["destination"], default = str))
+                origin = intern(self.__route[1], new)
+                destination = intern(self.__route[2], new)
+        if snapshot.registration is not None:
+            flags |= BINARY_HAS_REGISTRATION
+        icao24 = snapshot.icao24
+        if len(icao24) == 6 and not icao24.strip(HEX_DIGITS):
+            icao24 = int(icao24, 16)
+        else:
+            flags |= BINARY_ICAO24_STRING
+            icao24 = intern(icao24, new)
+        if self.__date[0] != snapshot.date:
+            # The date as proximity_payload() turns it into a string
+            date = datetime.utcfromtimestamp(snapshot.date)
+            self.__date = (snapshot.date, calendar.timegm(date.timetuple()), date.microsecond)
+        payload = BINARY_FORMAT.pack(BINARY_VERSION, flags, counter & 0xffffffff, int(now), icao24,
+                                     round(snapshot.lat * 1e5), round(snapshot.lon * 1e5), round(distance), int(snapshot.altitude),
+                                     int(snapshot.groundSpeed), int(snapshot.track), int(bearing), max(-32768, min(32767, int(vspeed))),
+                                     self.__date[1], self.__date[2],
+                                     intern(snapshot.operator, new), intern(snapshot.type, new), intern(snapshot.image_url, new), origin, destination,
+                                     (snapshot.registration or "").encode("utf-8"), (snapshot.callsign or "").encode("utf-8"))
+        return (payload, new)
+
+
+def decode_binary(payload: bytes, strings: Dict[int, str]) -> dict:
+    """Decode a binary report
+
+    Arguments:
+        payload {bytes} -- The report
+        strings {Dict[int, str]} -- The strings received on the strings topic, by id
+
+    Returns:
+        dict -- The report as proximity_payload() returns it, registrations and callsigns cut at 8 bytes
+    """
+    (version, flags, counter, now, icao24, lat, lon, distance, altitude, speed, heading, bearing, vspeed, date, microsecond,
+     operator, type, image, origin, destination, registration, callsign) = BINARY_FORMAT.unpack(payload)
+    if version != BINARY_VERSION:
+        raise ValueError("Unknown binary report version %d" % (version))
+    route = ""
+    if flags & BINARY_HAS_ROUTE:
+        route = {}
+        if origin and destination:
+            # Not known if the airport has not been received yet
+            (origin, destination) = (strings.get(origin), strings.get(destination))
+            route = {"origin": json.loads(origin) if origin is not None else None, "destination": json.loads(destination) if destination is not None else None}
+    return {
+        "vspeed": vspeed if flags & BINARY_HAS_VSPEED else None,
+        "time": now,
+        "lat": lat / 1e5,
+        "lon": lon / 1e5,
+        "distance": round(distance / 1000, COORDINATE_DECIMALS),
+        "image": strings.get(image),
+        "altitude": altitude,
+        "speed": speed,
+        "icao24": strings.get(icao24) if flags & BINARY_ICAO24_STRING else "%06X" % (icao24),
+        "registration": registration.rstrip(b"\0").decode("utf-8", "replace") if flags & BINARY_HAS_REGISTRATION else None,
+        "heading": heading,
+        "operator": strings.get(operator),
+        "bearing": bearing,
+        "loggedDate": "%s" % (datetime(1970, 1, 1) + timedelta(seconds = date, microseconds = microsecond)),
+        "type": strings.get(type),
+        "callsign": callsign.rstrip(b"\0").decode("utf-8", "replace"),
+        "route": route,
+        "counter": counter,
+    }
+
+
+class DeltaEncoder(object):
+    """
+    Encodes proximity reports as keyframes and deltas. Not thread safe apart
+    from requestKeyframe(), use one per publishing thread.
+    """
+
+    def __init__(self, keyframe_interval: float = KEYFRAME_INTERVAL):
+        """Create an encoder
+
+        Keyword Arguments:
+            keyframe_interval {float} -- Seconds between keyframes (default: {KEYFRAME_INTERVAL})
+        """
+        self.__keyframe_interval = keyframe_interval
+        self.__last = None  # The report last encoded
+        self.__next_keyframe = 0
+        self.__keyframe_requested = False
+        self.keyframes = 0
+        self.deltas = 0
+
+    def requestKeyframe(self):
+        """Make the next report a keyframe, may be called from any thread
+        """
+        self.__keyframe_requested = True
+
+    def encode(self, snapshot: "flighttracker.ObservationSnapshot", bearing: float, distance: float, now: float, counter: int, serializer: JSONSerializer = None) -> str:
+        """Encode the report proximity_payload(snapshot, bearing, distance, now, counter) describes
+
+        Keyword Arguments:
+            serializer {JSONSerializer} -- Serialize keyframes with this (default: {None})
+
+        Returns:
+            str -- JSON of a keyframe, identical to the full report, or of a delta
+        """
+        report = proximity_payload(snapshot, bearing, distance, now, counter)
+        last = self.__last
+        self.__last = report
+        monotonic = time.monotonic()
+        if last is None or last["icao24"] != report["icao24"] or monotonic >= self.__next_keyframe or self.__keyframe_requested:
+            self.__keyframe_requested = False
+            self.__next_keyframe = monotonic + self.__keyframe_interval
+            self.keyframes += 1
+            if serializer is not None:
+                return serializer.json(snapshot, bearing, distance, now, counter)
+            return json.dumps(report)
+        self.deltas += 1
+        delta = {key: value for (key, value) in report.items() if key in DELTA_FIELDS or last[key] != value}
+        delta["delta"] = True
+        return json.dumps(delta)
+
+
+class DeltaDecoder(object):
+    """
+    Reassembles full reports from keyframes and deltas
+    """
+
+    def __init__(self):
+        self.__report = None
+
+    def decode(self, message: dict) -> dict|None:
+        """Decode a report
+
+        Arguments:
+            message {dict} -- The JSON received
+
+        Returns:
+            dict|None -- The full report or None if reports were lost, ask for a keyframe and wait for it
+        """
+        if not message.get("delta"):
+            self.__report = dict(message)
+            return dict(message)
+        report = self.__report
+        if report is None or message["counter"] != report["counter"] + 1 or message["icao24"] != report["icao24"]:
+            self.__report = None
+            return None
+        report.update(message)
+        del report["delta"]
+        return dict(report)
+
+
+def _check():
+    """Compare JSONSerializer with json.dumps of the payload"""
+    import math
+    import random
+    import flighttracker
+    random.seed(1)
+    airports = [
+        {"iata": "MMX", "name": "Malmö Sturup", "lat": 55.53, "lon": 13.37},
+        {"iata": "ARN", "name": "Stockholm \"Arlanda\" 100%", "lat": 59.65, "lon": 17.92},
+        {"iata": "ORD", "name": "O'Hare International", "lat": 41.97, "lon": -87.9},
+    ]
+    serializer = JSONSerializer(cache_size = 4)
+    encoder = BinaryEncoder(StringTable(max_size = 6))
+    received = {}  # The retained strings a subscriber has
+    for i in range(5000):
+        icao24 = "%06X" % (random.randint(1, 8)) if i % 50 else random.choice(("~4CA7B5", "4CA7B5X", "4C 7B5", "0x4CA7"))
+        if random.random() < 0.5:
+            (src, dst) = random.sample(airports, 2)
+            route = {"origin": src, "destination": dst}
+            # As resolve_route() puts it together
+            route_json = '{"origin": %s, "destination": %s}' % (json.dumps(src), json.dumps(dst))
+        else:
+            (route, route_json) = random.choice(((None, None), ({}, "{}")))
+        snapshot = flighttracker.ObservationSnapshot(
+            icao24, random.choice((None, "SAS123", "RYR4TX  ")),
+            random.uniform(0, 40000), random.uniform(0, 600), random.uniform(0, 360), random.uniform(-90, 90), random.uniform(-180, 180),
+            random.choice((math.nan, random.uniform(-3000, 3000))), 0, random.uniform(1.7e9, 1.8e9) if random.random() < 0.9 else 1.7e9,
+            random.choice((None, "Scandinavian Airlines", "Wizz Air Hungary")), random.choice((None, "SE-RJX")),
+            random.choice((None, "A320", "Boeing 737 \"MAX\"")), route, route_json,
+            random.choice((None, "http://example.com/a%20b.jpg", "http://example.com/å'.jpg")))
+        args = (snapshot, random.uniform(0, 360), round(random.uniform(0, 200000), -2), random.uniform(1.7e9, 1.8e9), i)
+        expected = json.dumps(proximity_payload(*args))
+        assert serializer.json(*args) == expected, "%s != %s" % (serializer.json(*args), expected)
+        (payload, new) = encoder.encode(*args)
+        assert len(payload) == BINARY_FORMAT.size
+        received.update(new)
+        assert json.dumps(decode_binary(payload, received)) == expected, "%s != %s" % (decode_binary(payload, received), expected)
+        # Before the strings have arrived
+        decode_binary(payload, {})
+    assert serializer.hits > 0 and serializer.misses > 0
+
+    # An aircraft flying by, then another one, with reports lost on the way
+    delta = DeltaEncoder(keyframe_interval = 1000)
+    decoder = DeltaDecoder()
+    lost = False
+    for i in range(1, 500):
+        snapshot = snapshot._replace(icao24 = "4787B0" if i < 250 else "4CA7B5", lat = 55 + i * 1e-3, date = 1.7e9 + i // 4)
+        args = (snapshot, i % 360, 1000 * i, 1.7e9 + i // 4, i)
+        message = json.loads(delta.encode(*args))
+        if i % 97 == 0:
+            # Lost
+            lost = True
+            continue
+        report = decoder.decode(message)
+        if report is None:
+            assert lost, "Report %d" % (i)
+            delta.requestKeyframe()
+        else:
+            assert report == proximity_payload(*args), "Report %d" % (i)
+            lost = False
+    assert delta.keyframes < 20 and delta.deltas > 400
+
+
+if __name__ == "__main__":
+    _check()
+    print("All good")
@@ -0,0 +1,219 @@
+#
+# Copyright (c) 2024 Johan Kanflo (github.com/kanflo)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+#
+# Record SBS1 feeds to disk and play them back.
+#
+# Recordings are gzip compressed segment files named <file>-YYYYMMDD-HHMMSS.gz
+# where each line is the time of reception followed by a space and the raw
+# SBS1 line:
+#
+#   1709294400.123 MSG,3,1,1,4787B0,1,2024/03/01,12:00:01.012,...
+#
+# Plain SBS1 captures (eg. from nc) can be played back too, their lines are
+# played back without delay.
+#
+
+from typing import *
+import os
+import gzip
+import mmap
+import time
+import logging
+
+# Start a new segment this often
+SEGMENT_SECONDS = 3600
+# Flush the current segment this often
+FLUSH_INTERVAL = 10
+
+
+class Recorder(object):
+    """
+    Write received lines to rotating compressed segment files
+    """
+
+    def __init__(self, path: str, segment_seconds: int = SEGMENT_SECONDS):
+        """Create a recorder
+
+        Arguments:
+            path {str} -- Base name of segment files
+
+        Keyword Arguments:
+            segment_seconds {int} -- Start a new segment this often (default: {SEGMENT_SECONDS})
+        """
+        if path.endswith(".gz"):
+            path = path[:-3]
+        self.__path = path
+        self.__segment_seconds = segment_seconds
+        self.__file = None
+        self.__segment_end = 0
+        self.__next_flush = 0
+
+    def write(self, line: str):
+        """Record a line
+
+        Arguments:
+            line {str} -- SBS1 line without line terminator
+        """
+        now = time.time()
+        if now >= self.__segment_end:
+            self.__rotate(now)
+        elif now >= self.__next_flush:
+            self.__file.flush()
+            self.__next_flush = now + FLUSH_INTERVAL
+        self.__file.write(("%.3f %s\n" % (now, line)).encode("utf-8"))
+
+    def close(self):
+        """Close the current segment
+        """
+        if self.__file:
+            self.__file.close()
+            self.__file = None
+
+    def __rotate(self, now: float):
+        self.close()
+        name = "%s-%s.gz" % (self.__path, time.strftime("%Y%m%d-%H%M%S", time.localtime(now)))
+        logging.info("Recording to %s" % (name))
+        self.__file = gzip.open(name, "ab")
+        self.__segment_end = now + self.__segment_seconds
+        self.__next_flush = now + FLUSH_INTERVAL
+
+
+class PlaybackClock(object):
+    """
+    The time of the recording being played back. It stands in for
+    time.monotonic() and so starts where time.monotonic() was, then follows
+    the recorded timestamps. Between lines it runs at the playback speed, at
+    max speed it stands still.
+    """
+
+    def __init__(self, speed: float = 1):
+        """Create a playback clock
+
+        Keyword Arguments:
+            speed {float} -- Playback speed factor, 0 for as fast as possible (default: {1})
+        """
+        self.speed = speed
+        self.__offset = None  # Clock time minus recorded time
+        # Clock time of the last recorded line and the time.monotonic() it was played,
+        # replaced as a whole as the publish thread reads the clock
+        self.__anchor = (time.monotonic(), time.monotonic())
+
+    def sync(self, recorded: float):
+        """Set the clock to the time a line was recorded, as it is played
+
+        Arguments:
+            recorded {float} -- time.time() when the line was recorded
+        """
+        if self.__offset is None:
+            self.__offset = self() - recorded
+        self.__anchor = (recorded + self.__offset, time.monotonic())
+
+    def __call__(self) -> float:
+        """Return the current time of the recording
+
+        Returns:
+            float -- Seconds, comparable to time.monotonic() at the start of playback
+        """
+        (clock, wall) = self.__anchor
+        return clock + (time.monotonic() - wall) * self.speed
+
+
+def parse_speed(speed: str) -> float:
+    """Parse a playback speed like 1x, 10x or max
+
+    Arguments:
+        speed {str} -- Playback speed
+
+    Returns:
+        float -- Speed factor, 0 for as fast as possible
+    """
+    if speed in ("max", "0", "0x"):
+        return 0
+    factor = float(speed.rstrip("xX"))
+    if factor <= 0:
+        raise ValueError("Playback speed must be positive: %s" % (speed))
+    return factor
+
+
+def __mapped_lines(path: str) -> Iterator[bytes]:
+    """Return the lines of a file, memory mapped so that large files are not read into memory"""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            if m[:2] == b"\x1f\x8b":
+                # Decompress straight from the mapping
+                with gzip.GzipFile(fileobj=m) as gz:
+                    try:
+                        yield from gz
+                    except EOFError:
+                        # The segment being recorded has no trailer until it is closed
+                        logging.warning("%s is truncated, played back what could be decompressed" % (path))
+                return
+            start = 0
+            size = len(m)
+            while start < size:
+                end = m.find(b"\n", start)
+                if end < 0:
+                    end = size
+                yield m[start:end]
+                start = end + 1
+
+
+def replay(paths: List[str], speed: float = 1, clock: PlaybackClock = None) -> Iterator[str]:
+    """Play back recorded files in order
+
+    Arguments:
+        paths {List[str]} -- Recordings or plain SBS1 captures
+
+    Keyword Arguments:
+        speed {float} -- Playback speed factor, 0 for as fast as possible (default: {1})
+        clock {PlaybackClock} -- Clock to set to the time each line was recorded (default: {None})
+
+    Yields:
+        str -- An SBS1 line
+    """
+    first_time = None
+    start = time.monotonic()
+    for path in paths:
+        logging.info("Playing back %s" % (path))
+        for raw in __mapped_lines(path):
+            line = raw.decode("utf-8", "replace").rstrip("\r\n")
+            (stamp, sep, sbs1_line) = line.partition(" ")
+            if sep and stamp[:1].isdigit():
+                line = sbs1_line
+                try:
+                    recorded = float(stamp)
+                except ValueError:
+                    recorded = None
+                if recorded is not None:
+                    if speed:
+                        if first_time is None:
+                            first_time = recorded
+                        delay = start + (recorded - first_time) / speed - time.monotonic()
+                        if delay > 0:
+                            time.sleep(delay)
+                    if clock:
+                        clock.sync(recorded)
+            if line:
+                yield line
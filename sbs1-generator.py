@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2024 Johan Kanflo (github.com/kanflo)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+#
+# A stand-in for dump1090 serving synthetic SBS1 data on a TCP port, for
+# soak testing flighttracker.py without an SDR or an adsbhub account.
+#
+# Aircraft fly great circle tracks between random points around the given
+# location. Every client gets its own fleet and message stream.
+#
+#   % ./sbs1-generator.py -l 55.6 -L 13.0 --aircraft 1000 --rate 5000
+#   % ./flighttracker.py -H 127.0.0.1 -P 30003 -l 55.6 -L 13.0 ...
+#
+
+from typing import *
+import sys
+import time
+import random
+import logging
+import argparse
+import socketserver
+import coloredlogs
+from datetime import datetime
+import utils
+
+# Messages are sent in batches this often
+TICK_INTERVAL = 0.01
+# Default message mix, type:weight
+DEFAULT_MIX = "1:1,3:4,4:4,5:1"
+
+args = None
+
+
+class Aircraft(object):
+    """
+    A simulated aircraft flying great circle tracks between random waypoints
+    """
+
+    def __init__(self, lat: float, lon: float, radius_km: float):
+        self.__center = (lat, lon)
+        self.__radius_km = radius_km
+        self.icao24 = "%06X" % random.randint(1, 0xffffff)
+        self.callsign = "%s%d" % ("".join(random.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ") for _ in range(3)), random.randint(1, 9999))
+        (self.lat, self.lon) = self.__random_point()
+        self.altitude = random.randint(20, 400) * 100
+        self.verticalRate = 0
+        self.groundSpeed = random.randint(120, 480)
+        self.__new_waypoint()
+        self.__time = time.monotonic()
+
+    def advance(self, now: float):
+        """Move the aircraft along its track up to the given time
+        """
+        duration = now - self.__time
+        self.__time = now
+        if duration <= 0:
+            return
+        (self.lat, self.lon) = utils.calc_travel2(self.lat, self.lon, duration, self.groundSpeed, self.track)
+        self.altitude = max(0, self.altitude + int(self.verticalRate * duration / 60))
+        if random.random() < 0.01:
+            self.verticalRate = random.choice((0, 0, 0, -1500, -640, 640, 2240))
+        if utils.coordinate_distance(self.lat, self.lon, self.__waypoint[0], self.__waypoint[1]) < 1000:
+            self.__new_waypoint()
+        else:
+            # Follow the great circle towards the waypoint
+            self.track = utils.bearing(self.lat, self.lon, self.__waypoint[0], self.__waypoint[1])
+
+    def __random_point(self) -> Tuple[float, float]:
+        return utils.calc_travel2(self.__center[0], self.__center[1], 3600, self.__radius_km / 1.852 * random.random(), random.uniform(0, 360))
+
+    def __new_waypoint(self):
+        self.__waypoint = self.__random_point()
+        self.track = utils.bearing(self.lat, self.lon, self.__waypoint[0], self.__waypoint[1])
+
+
+def parse_mix(mix: str) -> Tuple[List[int], List[float]]:
+    """Parse a message mix given as type:weight,type:weight,...
+
+    Returns:
+        Tuple[List[int], List[float]] -- Transmission types and their weights
+    """
+    types = []
+    weights = []
+    for item in mix.split(","):
+        (msg_type, _, weight) = item.partition(":")
+        types.append(int(msg_type))
+        weights.append(float(weight) if weight else 1)
+    return (types, weights)
+
+
+def sbs1_message(aircraft: Aircraft, msg_type: int, icao24: str = None) -> str:
+    """Format an SBS1 message for the aircraft
+
+    Arguments:
+        aircraft {Aircraft} -- The aircraft
+        msg_type {int} -- Transmission type, 1, 3, 4 or 5
+
+    Keyword Arguments:
+        icao24 {str} -- Override the aircraft's icao24 (default: {None})
+
+    Returns:
+        str -- SBS1 message
+    """
+    now = datetime.now()
+    stamp = "%s,%s" % (now.strftime("%Y/%m/%d"), now.strftime("%H:%M:%S.%f")[:-3])
+    header = "MSG,%d,1,1,%s,1,%s,%s" % (msg_type, icao24 if icao24 else aircraft.icao24, stamp, stamp)
+    if msg_type == 1:
+        return "%s,%-8s,,,,,,,,,,,0" % (header, aircraft.callsign)
+    elif msg_type == 3:
+        return "%s,,%d,,,%.5f,%.5f,,,0,0,0,0" % (header, aircraft.altitude, aircraft.lat, aircraft.lon)
+    elif msg_type == 4:
+        return "%s,,,%d,%d,,,%d,,0,0,0,0" % (header, aircraft.groundSpeed, aircraft.track, aircraft.verticalRate)
+    else:
+        return "%s,,%d,,,,,,,0,,0,0" % (header, aircraft.altitude)
+
+
+def malformed_message(aircraft: Aircraft) -> str:
+    """Return a broken message of the kind that shows up on real feeds
+    """
+    msg = sbs1_message(aircraft, 3)
+    kind = random.randint(0, 3)
+    if kind == 0:
+        return msg[:random.randint(0, len(msg) - 1)]
+    elif kind == 1:
+        return msg.replace(",", ",,", 1)
+    elif kind == 2:
+        return msg.replace("/", "x", 1)
+    return "".join(chr(random.randint(32, 126)) for _ in range(random.randint(1, 80)))
+
+
+class GeneratorHandler(socketserver.BaseRequestHandler):
+    """
+    Stream synthetic SBS1 messages to a client
+    """
+
+    def handle(self):
+        logging.info("Client %s:%d connected" % self.client_address)
+        fleet = [Aircraft(args.lat, args.lon, args.radius) for _ in range(args.aircraft)]
+        (types, weights) = parse_mix(args.mix)
+        sent = 0
+        start = last_report = time.monotonic()
+        credit = 0.0
+        try:
+            while True:
+                now = time.monotonic()
+                if args.rate > 0:
+                    credit += args.rate * TICK_INTERVAL
+                    count = int(credit)
+                    credit -= count
+                else:
+                    count = 1000
+                lines = []
+                for msg_type in random.choices(types, weights, k=count):
+                    aircraft = random.choice(fleet)
+                    aircraft.advance(now)
+                    r = random.random()
+                    if r < args.ghosts:
+                        lines.append(sbs1_message(aircraft, msg_type, "000000"))
+                    elif r < args.ghosts + args.malformed:
+                        lines.append(malformed_message(aircraft))
+                    else:
+                        lines.append(sbs1_message(aircraft, msg_type))
+                if lines:
+                    self.request.sendall(("\r\n".join(lines) + "\r\n").encode("utf-8"))
+                sent += count
+                if now - last_report >= 10:
+                    logging.info("Sent %d messages to %s:%d (%.0f msgs/s)" % (sent, self.client_address[0], self.client_address[1], sent / (now - start)))
+                    last_report = now
+                if args.rate > 0:
+                    delay = TICK_INTERVAL - (time.monotonic() - now)
+                    if delay > 0:
+                        time.sleep(delay)
+        except (BrokenPipeError, ConnectionResetError):
+            logging.info("Client %s:%d disconnected" % self.client_address)
+
+
+class GeneratorServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def main():
+    global args
+    parser = argparse.ArgumentParser(description='Synthetic SBS1 feed, a stand-in for dump1090')
+    parser.add_argument('-l', '--lat', type=float, help="Latitude of simulated airspace", required=True)
+    parser.add_argument('-L', '--lon', type=float, help="Longitude of simulated airspace", required=True)
+    parser.add_argument('-r', '--radius', type=float, help="Radius of simulated airspace in km (default 200)", default=200)
+    parser.add_argument('-P', '--port', type=int, help="Port to serve SBS1 on (default 30003)", default=30003)
+    parser.add_argument('-n', '--aircraft', type=int, help="Number of aircraft (default 100)", default=100)
+    parser.add_argument('-R', '--rate', type=float, help="Messages per second, 0 for as fast as possible (default 1000)", default=1000)
+    parser.add_argument('-x', '--mix', help="Message type mix as type:weight,... (default %s)" % DEFAULT_MIX, default=DEFAULT_MIX)
+    parser.add_argument('-g', '--ghosts', type=float, help="Fraction of ghost messages from 000000 (default 0.001)", default=0.001)
+    parser.add_argument('-b', '--malformed', type=float, help="Fraction of malformed messages (default 0.001)", default=0.001)
+    parser.add_argument('-v', '--verbose', action="store_true", help="Verbose output")
+    args = parser.parse_args()
+
+    styles = {'critical': {'bold': True, 'color': 'red'}, 'debug': {'color': 'green'}, 'error': {'color': 'red'}, 'info': {'color': 'white'}, 'notice': {'color': 'magenta'}, 'spam': {'color': 'green', 'faint': True}, 'success': {'bold': True, 'color': 'green'}, 'verbose': {'color': 'blue'}, 'warning': {'color': 'yellow'}}
+    level = logging.DEBUG if args.verbose else logging.INFO
+    coloredlogs.install(level=level, fmt='%(asctime)s.%(msecs)03d \033[0;90m%(levelname)-8s '
+                        ''
+                        '\033[0;36m%(filename)-18s%(lineno)3d\033[00m '
+                        '%(message)s',
+                        level_styles = styles)
+    logging.info("---[ Starting %s ]---------------------------------------------" % sys.argv[0])
+
+    with GeneratorServer(("", args.port), GeneratorHandler) as server:
+        logging.info("Serving %d aircraft at %.0f msgs/s on port %d" % (args.aircraft, args.rate, args.port))
+        server.serve_forever()
+
+
+# Ye ol main
+if __name__ == "__main__":
+    main()
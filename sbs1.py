@@ -15,6 +15,12 @@ except ImportError as e:
     import sys
     print("dateutil module not installed, try 'sudo pip install python-dateutil'")
     sys.exit(1)
+try:
+    import numpy as np
+except ImportError as e:
+    import sys
+    print("numpy module not installed, try 'sudo pip install numpy'")
+    sys.exit(1)
 
 
 ES_IDENT_AND_CATEGORY = 1
@@ -26,7 +32,7 @@ SURVEILLANCE_ID = 6
 AIR_TO_AIR = 7
 ALL_CALL_REPLY = 8
 
-def parse(msg: str) -> Dict[str, Union[str, int, float, bool, datetime]]:
+def parse(msg: str, lazy: bool = False) -> Dict[str, Union[str, int, float, bool, datetime]]:
     """Parse message from the feed output by dump1090 on port 30003
 
     A dict is returned withAn SBS-1 message has the following attributes:
@@ -56,11 +62,19 @@ def parse(msg: str) -> Dict[str, Union[str, int, float, bool, datetime]]:
 
     A field not present in the parsed message will be set to None. For a
     description of the attributes, please see github.com/wiseman/node-sbs1
+
+    If lazy is True an SBS1Message is returned instead of a dict. Only the
+    fields defined for the transmission type are parsed up front, the rest
+    are parsed when accessed.
     """
     if msg is None:
         return None
     sbs1 = {}
     parts = msg.lstrip().rstrip().split(',')
+    if lazy:
+        if __parseString(parts, 0) != "MSG":
+            return None
+        return SBS1Message(parts)
     try:
 #            logging.debug("%s   %s   %s" % (parts[1], parts[4], ",".join(parts[10:])))
         sbs1["messageType"] = __parseString(parts, 0)
@@ -92,6 +106,151 @@ def parse(msg: str) -> Dict[str, Union[str, int, float, bool, datetime]]:
         return None
     return sbs1
 
+def parse_batch(buffer: bytes) -> Dict[str, np.ndarray]:
+    """Parse a chunk of CRLF (or LF) separated messages into columns
+
+    The buffer must only contain complete lines. Lines that are not MSG
+    lines or lack a valid icao24 or transmission type are skipped. A dict of equally long NumPy
+    arrays is returned:
+
+        icao24 : uint32
+        transmissionType : uint8
+        generatedDate : datetime64[ms]
+        loggedDate : datetime64[ms]
+        callsign : str
+        altitude : float64
+        groundSpeed : float64
+        track : float64
+        lat : float64
+        lon : float64
+        verticalRate : float64
+
+    Missing values are NaN (NaT for the dates, "" for callsign).
+    """
+    rows = []
+    for line in buffer.split(b"\n"):
+        parts = line.strip().split(b",")
+        if parts[0] != b"MSG":
+            continue
+        if len(parts) < 22:
+            parts.extend([b""] * (22 - len(parts)))
+        rows.append(parts)
+    if not rows:
+        columns = [()] * 22
+    else:
+        columns = list(zip(*rows))
+
+    (icao24, valid) = __batchIcao24(columns[4])
+    # NaN fails the range test
+    transmissionType = __batchFloat(columns[1])
+    valid &= (transmissionType >= ES_IDENT_AND_CATEGORY) & (transmissionType <= ALL_CALL_REPLY) & (transmissionType == np.floor(transmissionType))
+    transmissionType[~valid] = 0
+    batch = {
+        "icao24": icao24,
+        "transmissionType": transmissionType.astype(np.uint8),
+        "generatedDate": __batchDateTime(columns[6], columns[7]),
+        "loggedDate": __batchDateTime(columns[8], columns[9]),
+        "callsign": __batchCallsign(columns[10]),
+        "altitude": __batchFloat(columns[11]),
+        "groundSpeed": __batchFloat(columns[12]),
+        "track": __batchFloat(columns[13]),
+        "lat": __batchFloat(columns[14]),
+        "lon": __batchFloat(columns[15]),
+        "verticalRate": __batchFloat(columns[16]),
+    }
+    if not valid.all():
+        for key in batch:
+            batch[key] = batch[key][valid]
+    return batch
+
+# Maps an ASCII character to its hex digit value, 255 for non hex digits
+_HEX_DIGITS = np.full(256, 255, dtype=np.uint8)
+for __i, __c in enumerate(b"0123456789ABCDEF"):
+    _HEX_DIGITS[__c] = __i
+    _HEX_DIGITS[ord(chr(__c).lower())] = __i
+del __i, __c
+_HEX_WEIGHTS = np.array([16**5, 16**4, 16**3, 16**2, 16, 1], dtype=np.uint32)
+
+def __batchIcao24(column: Sequence[bytes]):
+    """Parse a column of icao24 hex strings
+    Return tuple of uint32 values and a mask of the valid ones"""
+    # Check the lengths first, the cast to S6 silently cuts longer strings
+    valid = np.fromiter(map(len, column), dtype=np.intp, count=len(column)) == 6
+    strings = np.array(column, dtype="S6")
+    codes = np.frombuffer(strings.tobytes(), dtype=np.uint8).reshape(-1, 6)
+    digits = _HEX_DIGITS[codes]
+    valid &= (digits != 255).all(axis=1)
+    digits[~valid] = 0
+    return (digits.astype(np.uint32) @ _HEX_WEIGHTS, valid)
+
+def __batchCallsign(column: Sequence[bytes]):
+    """Parse a column of callsigns
+    Return str values without trailing spaces, at most 8 characters"""
+    strings = np.char.rstrip(np.array(column, dtype="S8"))
+    try:
+        return strings.astype("U8")
+    except UnicodeDecodeError:
+        # Not ASCII somewhere in the column, take the slow road
+        return np.array([value.decode("ascii", "replace") for value in strings], dtype="U8")
+
+def __batchFloat(column: Sequence[bytes]):
+    """Parse a column of numbers
+    Return float64 values with NaN for empty fields or fields that could not be parsed"""
+    strings = np.array(column, dtype="S")
+    if strings.itemsize < 3:
+        strings = strings.astype("S3")
+    strings[strings == b""] = b"nan"
+    try:
+        return strings.astype(np.float64)
+    except ValueError:
+        # Malformed field somewhere in the column, take the slow road
+        return np.array([__parseFloat([value], 0) for value in column], dtype=np.float64)
+
+def __batchDateTime(dates: Sequence[bytes], times: Sequence[bytes]):
+    """Parse columns of SBS-1 dates and times
+    Return datetime64[ms] values with NaT for missing or unparsable fields"""
+    n = len(dates)
+    stamps = np.full(n, np.datetime64("NaT"), dtype="datetime64[ms]")
+    if n == 0:
+        return stamps
+    date_len = np.fromiter(map(len, dates), dtype=np.int32, count=n)
+    time_len = np.fromiter(map(len, times), dtype=np.int32, count=n)
+    # Character codes minus '0', so digits are 0..9, '/' is -1, ':' is 10 and '.' is -2
+    d = np.frombuffer(np.array(dates, dtype="S10").tobytes(), dtype=np.uint8).reshape(n, 10).astype(np.int32) - 48
+    t = np.frombuffer(np.array(times, dtype="S12").tobytes(), dtype=np.uint8).reshape(n, 12).astype(np.int32) - 48
+    is_digit = lambda a: (a >= 0) & (a <= 9)
+
+    valid = (date_len == 10) & (d[:, 4] == -1) & (d[:, 7] == -1) & is_digit(d[:, [0, 1, 2, 3, 5, 6, 8, 9]]).all(axis=1)
+    valid &= ((time_len == 8) | ((time_len >= 10) & (time_len <= 12))) & (t[:, 2] == 10) & (t[:, 5] == 10) & is_digit(t[:, [0, 1, 3, 4, 6, 7]]).all(axis=1)
+    # Fraction of seconds, missing digits count as zeros
+    fraction = t[:, 9:12] * (np.arange(9, 12) < time_len[:, None])
+    valid &= (time_len == 8) | ((t[:, 8] == -2) & is_digit(fraction).all(axis=1))
+
+    year = d[:, 0] * 1000 + d[:, 1] * 100 + d[:, 2] * 10 + d[:, 3]
+    month = d[:, 5] * 10 + d[:, 6]
+    day = d[:, 8] * 10 + d[:, 9]
+    hour = t[:, 0] * 10 + t[:, 1]
+    minute = t[:, 3] * 10 + t[:, 4]
+    second = t[:, 6] * 10 + t[:, 7]
+    valid &= (month >= 1) & (month <= 12) & (day >= 1) & (day <= 31) & (hour < 24) & (minute < 60) & (second < 60)
+
+    # Keep invalid rows from overflowing the date arithmetic
+    year = np.where(valid, year, 1970)
+    month = np.where(valid, month, 1)
+    day = np.where(valid, day, 1)
+    months = (year - 1970).astype("datetime64[Y]").astype("datetime64[M]") + (month - 1).astype("timedelta64[M]")
+    days = months.astype("datetime64[D]") + (day - 1).astype("timedelta64[D]")
+    valid &= days.astype("datetime64[M]") == months  # eg. 2024/02/30
+    ms = ((hour * 60 + minute) * 60 + second) * 1000 + fraction[:, 0] * 100 + fraction[:, 1] * 10 + fraction[:, 2]
+    stamps[valid] = (days.astype("datetime64[ms]") + ms.astype("timedelta64[ms]"))[valid]
+
+    # Let the scalar parser have a go at anything else that is not empty
+    for i in np.flatnonzero(~valid & (date_len > 0) & (time_len > 0)):
+        dt = __parseDateTime([dates[i].decode("ascii", "replace"), times[i].decode("ascii", "replace")], 0, 1)
+        if dt:
+            stamps[i] = np.datetime64(dt, "ms")
+    return stamps
+
 def __parseString(array: List, index: int):
     """Parse string at given index in array
     Return string or None if string is empty or index is out of bounds"""
@@ -151,10 +310,131 @@ def __parseDateTime(array: List, dateIndex: int, timeIndex: int):
     time = __parseString(array, timeIndex)
     d = None
     if date != None and time != None:
-      try:
-        d = dateutil.parser.parse("%s %s" % (date, time))
-      except ValueError:
-        d = None
-      except TypeError:
-        d = None
+      d = __fastParseDateTime(date, time)
+      if d is None:
+        # Not in the YYYY/MM/DD,HH:MM:SS.fff layout, let dateutil have a go
+        try:
+          d = dateutil.parser.parse("%s %s" % (date, time))
+        except ValueError:
+          d = None
+        except TypeError:
+          d = None
+        except OverflowError:
+          d = None
     return d
+
+def __fastParseDateTime(date: str, time: str):
+    """Parse date and time in the fixed SBS-1 layout, eg. 2015/09/08 and 21:08:26.061
+    Return datetime value or None if the strings do not follow that layout"""
+    if len(date) != 10 or date[4] != '/' or date[7] != '/':
+        return None
+    if len(time) < 8 or time[2] != ':' or time[5] != ':':
+        return None
+    usec = 0
+    if len(time) > 8:
+        # isdigit() alone lets through eg. superscripts int() does not take
+        if time[8] != '.' or len(time) > 15 or not (time[9:].isascii() and time[9:].isdigit()):
+            return None
+        usec = int(time[9:].ljust(6, '0'))
+    try:
+        return datetime(int(date[0:4]), int(date[5:7]), int(date[8:10]), int(time[0:2]), int(time[3:5]), int(time[6:8]), usec)
+    except ValueError:
+        return None
+
+
+# Parsers for each field of an SBS-1 message
+_FIELD_PARSERS = {
+    "messageType": lambda parts: __parseString(parts, 0),
+    "transmissionType": lambda parts: __parseInt(parts, 1),
+    "sessionID": lambda parts: __parseString(parts, 2),
+    "aircraftID": lambda parts: __parseString(parts, 3),
+    "icao24": lambda parts: __parseString(parts, 4),
+    "flightID": lambda parts: __parseString(parts, 5),
+    "generatedDate": lambda parts: __parseDateTime(parts, 6, 7),
+    "loggedDate": lambda parts: __parseDateTime(parts, 8, 9),
+    "callsign": lambda parts: __parseCallsign(parts, 10),
+    "altitude": lambda parts: __parseInt(parts, 11),
+    "groundSpeed": lambda parts: __parseFloat(parts, 12),
+    "track": lambda parts: __parseFloat(parts, 13),
+    "lat": lambda parts: __parseFloat(parts, 14),
+    "lon": lambda parts: __parseFloat(parts, 15),
+    "verticalRate": lambda parts: __parseInt(parts, 16),
+    "squawk": lambda parts: __parseInt(parts, 17),
+    "alert": lambda parts: __parseBool(parts, 18),
+    "emergency": lambda parts: __parseBool(parts, 19),
+    "spi": lambda parts: __parseBool(parts, 20),
+    "onGround": lambda parts: __parseBool(parts, 21),
+}
+
+# Fields carried by each transmission type, see github.com/wiseman/node-sbs1
+TRANSMISSION_FIELDS = {
+    ES_IDENT_AND_CATEGORY: ("callsign",),
+    ES_SURFACE_POS: ("altitude", "groundSpeed", "track", "lat", "lon", "onGround"),
+    ES_AIRBORNE_POS: ("altitude", "lat", "lon", "alert", "emergency", "spi", "onGround"),
+    ES_AIRBORNE_VEL: ("groundSpeed", "track", "verticalRate"),
+    SURVEILLANCE_ALT: ("altitude", "alert", "spi", "onGround"),
+    SURVEILLANCE_ID: ("altitude", "squawk", "alert", "emergency", "spi", "onGround"),
+    AIR_TO_AIR: ("altitude", "onGround"),
+    ALL_CALL_REPLY: ("onGround",),
+}
+
+def __parseCallsign(array: List, index: int):
+    """Parse callsign at given index in array
+    Return callsign without trailing spaces or None if empty or index is out of bounds"""
+    callsign = __parseString(array, index)
+    if callsign:
+        callsign = callsign.rstrip()
+    return callsign
+
+
+class SBS1Message(object):
+    """A parsed SBS-1 message with the same attributes as the dict returned
+    by parse(). Fields not carried by the transmission type are parsed on
+    first access. Fields can be read as attributes or as msg["icao24"].
+    """
+    __slots__ = ("_parts",) + tuple(_FIELD_PARSERS.keys())
+
+    def __init__(self, parts: List[str]):
+        self._parts = parts
+        self.messageType = "MSG"
+        self.icao24 = _FIELD_PARSERS["icao24"](parts)
+        self.transmissionType = _FIELD_PARSERS["transmissionType"](parts)
+        for field in TRANSMISSION_FIELDS.get(self.transmissionType, ()):
+            setattr(self, field, _FIELD_PARSERS[field](parts))
+
+    def __getattr__(self, name: str):
+        # Only called for fields that have not been parsed yet
+        parser = _FIELD_PARSERS.get(name)
+        if parser is None:
+            raise AttributeError(name)
+        value = parser(self._parts)
+        setattr(self, name, value)
+        return value
+
+    def __getitem__(self, key: str):
+        if key not in _FIELD_PARSERS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key: str, default = None):
+        if key not in _FIELD_PARSERS:
+            return default
+        return getattr(self, key)
+
+
+def _check():
+    """Parse malformed messages, they must not raise"""
+    line = "MSG,3,1,1,4CA7B5,1,2024/03/01,%s,2024/03/01,12:00:00.125,,36000,,,55.61234,13.01234,,,0,0,0,0"
+    assert parse(line % ("12:00:00.123"))["generatedDate"] == datetime(2024, 3, 1, 12, 0, 0, 123000)
+    for time in ("12:00:00.12\u00b2", "12:00:00.\u0661\u0662", "12:00:00.", "12:00:00.1234567"):
+        parse(line % (time))["generatedDate"]
+
+    batch = parse_batch(b"MSG,1,1,1,4CA7B5,1,,,,,RYR4TX  ,,,,,,,,,,,0\r\nMSG,1,1,1,4787B0,1,,,,,SAS\xff12,,,,,,,,,,,0\r\n")
+    assert list(batch["callsign"]) == ["RYR4TX", "SAS\ufffd12"]
+    batch = parse_batch(b"".join(b"MSG,%s,1,1,4CA7B5,1,,,,,,,,,,,,,,,,0\r\n" % (type) for type in (b"3", b"300", b"-1", b"", b"2.5", b"x", b"8")))
+    assert list(batch["transmissionType"]) == [3, 8]
+
+
+if __name__ == "__main__":
+    _check()
+    print("All good")
@@ -0,0 +1,253 @@
+#
+# Copyright (c) 2024 Johan Kanflo (github.com/kanflo)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+#
+# Spatial index of aircraft positions for nearest neighbour and radius
+# queries, so that finding the closest aircraft does not mean computing the
+# distance to every aircraft on a global feed.
+#
+# Positions are placed on a sphere with the radius used by
+# utils.coordinate_distance and bucketed in a grid of cubes in earth
+# centered (ECEF) coordinates. Straight line distance grows with great
+# circle distance, so the nearest point in ECEF is the nearest one on the
+# ground and there are no special cases at the poles or the date line.
+#
+# Running this file checks the index against a linear scan.
+#
+
+from typing import *
+import math
+
+# Radius of the earth in meters, as in utils.coordinate_distance
+EARTH_RADIUS = 6371000
+# Side of a grid cell in meters
+CELL_SIZE = 50000
+
+
+def to_ecef(lat: float, lon: float) -> Tuple[float, float, float]:
+    """Convert a coordinate to earth centered coordinates on a spherical earth
+
+    Arguments:
+        lat {float} -- Latitude
+        lon {float} -- Longitude
+
+    Returns:
+        Tuple[float, float, float] -- x, y, z in meters
+    """
+    rlat = math.radians(lat)
+    rlon = math.radians(lon)
+    c = math.cos(rlat)
+    return (EARTH_RADIUS * c * math.cos(rlon), EARTH_RADIUS * c * math.sin(rlon), EARTH_RADIUS * math.sin(rlat))
+
+
+def chord_to_distance(chord: float) -> float:
+    """Convert a straight line distance to a great circle distance, both in meters
+    """
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, chord / (2 * EARTH_RADIUS)))
+
+
+def distance_to_chord(distance: float) -> float:
+    """Convert a great circle distance to a straight line distance, both in meters
+    """
+    return 2 * EARTH_RADIUS * math.sin(min(math.pi / 2, distance / (2 * EARTH_RADIUS)))
+
+
+class SpatialIndex(object):
+    """
+    Positions of keys (eg. icao24) in a grid, updated as the keys move
+    """
+
+    def __init__(self, cell_size: float = CELL_SIZE):
+        """Create an empty index
+
+        Keyword Arguments:
+            cell_size {float} -- Side of a grid cell in meters (default: {CELL_SIZE})
+        """
+        self.__cell_size = cell_size
+        self.__cells = {}  # cell -> {key: (x, y, z)}
+        self.__points = {}  # key -> (x, y, z, cell)
+
+    def update(self, key: Hashable, lat: float, lon: float):
+        """Add key or move it to a new position
+        """
+        (x, y, z) = to_ecef(lat, lon)
+        cell = (int(x // self.__cell_size), int(y // self.__cell_size), int(z // self.__cell_size))
+        old = self.__points.get(key)
+        if old is not None and old[3] != cell:
+            self.__remove_from_cell(key, old[3])
+        self.__cells.setdefault(cell, {})[key] = (x, y, z)
+        self.__points[key] = (x, y, z, cell)
+
+    def remove(self, key: Hashable):
+        """Remove key, if present
+        """
+        old = self.__points.pop(key, None)
+        if old is not None:
+            self.__remove_from_cell(key, old[3])
+
+    def __len__(self) -> int:
+        return len(self.__points)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.__points
+
+    def nearest(self, lat: float, lon: float, accept: Callable[[Hashable], bool] = None) -> Tuple[Hashable, float]|None:
+        """Find the key nearest to a coordinate
+
+        Arguments:
+            lat {float} -- Latitude
+            lon {float} -- Longitude
+
+        Keyword Arguments:
+            accept {Callable[[Hashable], bool]} -- Only consider keys for which this returns True (default: {None})
+
+        Returns:
+            Tuple[Hashable, float]|None -- Key and great circle distance in meters or None if no key was found
+        """
+        (x, y, z) = to_ecef(lat, lon)
+        size = self.__cell_size
+        (ci, cj, ck) = (int(x // size), int(y // size), int(z // size))
+        best = None
+        best_d2 = math.inf
+        k = 0
+        while True:
+            if (2 * k + 1) ** 3 >= len(self.__cells):
+                # The shell has more cells than there are occupied ones, scan those instead
+                for (cell, points) in self.__cells.items():
+                    if max(abs(cell[0] - ci), abs(cell[1] - cj), abs(cell[2] - ck)) >= k:
+                        (best, best_d2) = self.__nearest_in(points, x, y, z, accept, best, best_d2)
+                break
+            for cell in self.__shell(ci, cj, ck, k):
+                points = self.__cells.get(cell)
+                if points:
+                    (best, best_d2) = self.__nearest_in(points, x, y, z, accept, best, best_d2)
+            # Everything outside the shells searched so far is at least k cells away
+            if best is not None and best_d2 <= (k * size) ** 2:
+                break
+            k += 1
+        if best is None:
+            return None
+        return (best, chord_to_distance(math.sqrt(best_d2)))
+
+    def within(self, lat: float, lon: float, radius: float) -> List[Tuple[Hashable, float]]:
+        """Find all keys within a distance of a coordinate
+
+        Arguments:
+            lat {float} -- Latitude
+            lon {float} -- Longitude
+            radius {float} -- Great circle distance in meters
+
+        Returns:
+            List[Tuple[Hashable, float]] -- Keys and their great circle distances in meters, nearest first
+        """
+        (x, y, z) = to_ecef(lat, lon)
+        chord = distance_to_chord(radius)
+        max_d2 = chord * chord
+        size = self.__cell_size
+        r = int(chord // size) + 1
+        (ci, cj, ck) = (int(x // size), int(y // size), int(z // size))
+        if (2 * r + 1) ** 3 >= len(self.__cells):
+            cells = self.__cells.values()
+        else:
+            cells = (self.__cells.get((i, j, k)) for i in range(ci - r, ci + r + 1) for j in range(cj - r, cj + r + 1) for k in range(ck - r, ck + r + 1))
+        found = []
+        for points in cells:
+            if not points:
+                continue
+            for (key, (px, py, pz)) in points.items():
+                d2 = (px - x) ** 2 + (py - y) ** 2 + (pz - z) ** 2
+                if d2 <= max_d2:
+                    found.append((d2, key))
+        found.sort(key = lambda item: item[0])
+        return [(key, chord_to_distance(math.sqrt(d2))) for (d2, key) in found]
+
+    def __remove_from_cell(self, key: Hashable, cell: Tuple[int, int, int]):
+        points = self.__cells[cell]
+        del points[key]
+        if not points:
+            del self.__cells[cell]
+
+    @staticmethod
+    def __nearest_in(points: Dict, x: float, y: float, z: float, accept: Callable[[Hashable], bool], best: Hashable, best_d2: float) -> Tuple[Hashable, float]:
+        for (key, (px, py, pz)) in points.items():
+            d2 = (px - x) ** 2 + (py - y) ** 2 + (pz - z) ** 2
+            if d2 < best_d2 and (accept is None or accept(key)):
+                best = key
+                best_d2 = d2
+        return (best, best_d2)
+
+    @staticmethod
+    def __shell(ci: int, cj: int, ck: int, k: int) -> Iterator[Tuple[int, int, int]]:
+        """Return the cells exactly k cells away from (ci, cj, ck)"""
+        if k == 0:
+            yield (ci, cj, ck)
+            return
+        for i in range(-k, k + 1):
+            for j in range(-k, k + 1):
+                if abs(i) == k or abs(j) == k:
+                    for l in range(-k, k + 1):
+                        yield (ci + i, cj + j, ck + l)
+                else:
+                    yield (ci + i, cj + j, ck - k)
+                    yield (ci + i, cj + j, ck + k)
+
+
+def _check():
+    """Compare the index with a linear scan"""
+    import random
+    import utils
+    random.seed(1)
+    index = SpatialIndex()
+    points = {}
+    for i in range(5000):
+        # Half of them around Malmo, the rest anywhere
+        if i % 2:
+            points[i] = (random.uniform(53, 58), random.uniform(10, 16))
+        else:
+            points[i] = (math.degrees(math.asin(random.uniform(-1, 1))), random.uniform(-180, 180))
+        index.update(i, *points[i])
+    # Move some around and remove some
+    for i in range(0, 5000, 7):
+        points[i] = (random.uniform(-90, 90), random.uniform(-180, 180))
+        index.update(i, *points[i])
+    for i in range(0, 5000, 11):
+        del points[i]
+        index.remove(i)
+    assert len(index) == len(points)
+
+    for _ in range(200):
+        (lat, lon) = (random.uniform(-90, 90), random.uniform(-180, 180)) if random.random() < 0.5 else (random.uniform(54, 57), random.uniform(11, 15))
+        distances = {key: utils.coordinate_distance(lat, lon, plat, plon) for (key, (plat, plon)) in points.items()}
+        expected = min(distances, key = distances.get)
+        (key, distance) = index.nearest(lat, lon)
+        assert abs(distance - distances[expected]) < 0.01, "Nearest %s at %f, expected %s at %f" % (key, distance, expected, distances[expected])
+        (key, distance) = index.nearest(lat, lon, accept = lambda key: key % 3 == 0)
+        assert key == min((k for k in distances if k % 3 == 0), key = distances.get)
+        radius = random.choice((10000, 100000, 1000000))
+        found = index.within(lat, lon, radius)
+        assert sorted(key for (key, _) in found) == sorted(key for (key, d) in distances.items() if d <= radius)
+    assert SpatialIndex().nearest(0, 0) is None
+
+
+if __name__ == "__main__":
+    _check()
+    print("All good")
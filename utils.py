@@ -5,9 +5,12 @@
 #)
 import logging
 import math
+import numpy as np
 import bing
 import planedb
+import planecache
 from datetime import datetime
+from typing import Tuple
 
 
 def deg2rad(deg: float) -> float:
@@ -98,6 +101,72 @@ def calc_travel2(lat: float, lon: float, duration_s: float, speed_kts: float, he
     return (lat2, lon2)
 
 
+def bearing_array(lat1: np.ndarray, lon1: np.ndarray, lat2: np.ndarray, lon2: np.ndarray) -> np.ndarray:
+    """Array version of bearing(), arguments are arrays or scalars that broadcast
+
+    Arguments:
+        lat1 {np.ndarray} -- Start latitudes
+        lon1 {np.ndarray} -- Start longitudes
+        lat2 {np.ndarray} -- End latitudes
+        lon2 {np.ndarray} -- End longitudes
+
+    Returns:
+        np.ndarray -- bearings in degrees
+    """
+    rlat1 = np.radians(lat1)
+    rlat2 = np.radians(lat2)
+    dlon = np.radians(np.subtract(lon2, lon1))
+    b = np.arctan2(np.sin(dlon)*np.cos(rlat2), np.cos(rlat1)*np.sin(rlat2)-np.sin(rlat1)*np.cos(rlat2)*np.cos(dlon))
+    return np.mod(np.degrees(b)+360, 360)
+
+
+def coordinate_distance_array(lat1: np.ndarray, lon1: np.ndarray, lat2: np.ndarray, lon2: np.ndarray) -> np.ndarray:
+    """Array version of coordinate_distance(), arguments are arrays or scalars that broadcast
+
+    Arguments:
+        lat1 {np.ndarray} -- Start latitudes
+        lon1 {np.ndarray} -- Start longitudes
+        lat2 {np.ndarray} -- End latitudes
+        lon2 {np.ndarray} -- End longitudes
+
+    Returns:
+        np.ndarray -- Distances in meters
+    """
+    R = 6371 # Radius of the earth in km
+    dLat = np.radians(np.subtract(lat2, lat1))
+    dLon = np.radians(np.subtract(lon2, lon1))
+    a = np.sin(dLat/2) * np.sin(dLat/2) + np.cos(np.radians(lat1)) * np.cos(np.radians(lat2)) * np.sin(dLon/2) * np.sin(dLon/2)
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1-a))
+    return R * c * 1000
+
+
+def calc_travel2_array(lat: np.ndarray, lon: np.ndarray, duration_s: np.ndarray, speed_kts: np.ndarray, heading: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Array version of calc_travel2(), arguments are arrays or scalars that broadcast
+
+    Arguments:
+        lat {np.ndarray} -- Starting latitudes
+        lon {np.ndarray} -- Starting longitudes
+        duration_s {np.ndarray} -- Travel durations in seconds
+        speed_kts {np.ndarray} -- Speeds in knots
+        heading {np.ndarray} -- Headings in degress
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray] -- The new latitudes and longitudes
+    """
+    R = 6378.1 # Radius of the Earth
+    brng = np.radians(heading)
+    speed_mps = 0.514444 * np.asarray(speed_kts, dtype=np.float64)
+    d = (duration_s * speed_mps) / 1000.0 # Distance in km
+
+    lat1 = np.radians(lat)
+    lon1 = np.radians(lon)
+
+    lat2 = np.arcsin(np.sin(lat1)*np.cos(d/R) + np.cos(lat1)*np.sin(d/R)*np.cos(brng))
+    lon2 = lon1 + np.arctan2(np.sin(brng)*np.sin(d/R)*np.cos(lat1), np.cos(d/R)-np.sin(lat1)*np.sin(lat2))
+
+    return (np.degrees(lat2), np.degrees(lon2))
+
+
 def calc_travel(lat: float, lon: float, utc_start: datetime, speed_kts: float, heading: float) -> tuple[float, float]:
     """Calculate travel from lat, lon starting at a utc_start with given speed and heading to now
 
@@ -192,14 +261,193 @@ def image_search(icao24: str, operator: str|None = None, type: str|None = None,
             logging.info("Added image %s for %s", img_url, icao24)
             if not planedb.update_aircraft(icao24, {'image' : img_url}):
                 logging.error("Failed to update PlaneDB image for %s" % (icao24))
+            planecache.aircraft_cache.invalidate(icao24)
         return img_url
     else:
         logging.error("Image search came up short for '%s', blacklisted (%s)?" % (searchTerm, icao24))
     return img_url
 
-def find_time_min_distance(my_lat: float, my_lon: float, lat: float, lon: float, speed_kts: float, heading: float) -> tuple[float|None, float|None]:
+# Seconds ahead find_time_min_distance looks by default
+CPA_HORIZON = 60
+# Radius of the earth used by coordinate_distance and calc_travel2, in meters
+DISTANCE_RADIUS = 6371000
+TRAVEL_RADIUS = 6378100
+
+
+# Geodesy modes of Observer, fastest first
+GEODESY_MODES = ("equirectangular", "enu", "haversine")
+
+
+def geodesy_error_bound(mode: str, lat: float, max_range: float) -> float:
+    """Return the largest error of Observer distances compared to
+    coordinate_distance, for targets within max_range of an observer at lat
+
+      haversine       : 0, it is the same formula
+      enu             : r^3 / (6 R^2), 0.5 m at 50 km and 4 m at 100 km
+      equirectangular : r^3 / R^2 * (1/6 + tan^2(lat) / 12), 1 m at 50 km at 55 degrees
+
+    Bearings are within 0.05 degrees of bearing() up to 100 km and 70
+    degrees latitude in all modes. The bounds are checked by running utils.py.
+
+    Arguments:
+        mode {str} -- One of GEODESY_MODES
+        lat {float} -- Latitude of observer
+        max_range {float} -- Range in meters
+
+    Returns:
+        float -- Max error in meters
+    """
+    r3 = max_range ** 3 / DISTANCE_RADIUS ** 2
+    if mode == "haversine":
+        return 0
+    elif mode == "enu":
+        return r3 / 6
+    elif mode == "equirectangular":
+        return r3 * (1 / 6 + math.tan(math.radians(lat)) ** 2 / 12)
+    raise ValueError("Unknown geodesy mode %s" % (mode))
+
+
+def select_geodesy_mode(lat: float, max_range: float, max_error: float) -> str:
+    """Return the fastest geodesy mode with an error below max_error within max_range of an observer at lat
+    """
+    for mode in GEODESY_MODES:
+        if geodesy_error_bound(mode, lat, max_range) <= max_error:
+            return mode
+    return "haversine"
+
+
+class Observer(object):
+    """
+    Distances and bearings from a fixed observer, eg. the receiver. The trig
+    of the observer's latitude is computed once. Targets further away than
+    max_range are always handled with haversine.
+    """
+
+    def __init__(self, lat: float, lon: float, mode: str = "haversine", max_range: float = 100000):
+        """Create an observer
+
+        Arguments:
+            lat {float} -- Latitude of observer
+            lon {float} -- Longitude of observer
+
+        Keyword Arguments:
+            mode {str} -- One of GEODESY_MODES, see geodesy_error_bound (default: {"haversine"})
+            max_range {float} -- Range in meters the fast modes are used within (default: {100000})
+        """
+        if mode not in GEODESY_MODES:
+            raise ValueError("Unknown geodesy mode %s" % (mode))
+        self.lat = lat
+        self.lon = lon
+        self.mode = mode
+        self.__rlat = math.radians(lat)
+        self.__sin_lat = math.sin(self.__rlat)
+        self.__cos_lat = math.cos(self.__rlat)
+        self.__max_range = max_range
+        # Cosine of the angle at the center of the earth spanned by max_range
+        self.__cos_max_angle = math.cos(min(math.pi, max_range / DISTANCE_RADIUS))
+
+    def distance(self, lat: float, lon: float) -> float:
+        """Return distance in meters to a coordinate
+        """
+        if self.mode == "equirectangular":
+            dlat = math.radians(lat) - self.__rlat
+            dlon = math.radians((lon - self.lon + 180) % 360 - 180)
+            # cos() of the mean latitude to first order
+            d = DISTANCE_RADIUS * math.hypot(dlon * (self.__cos_lat - self.__sin_lat * dlat / 2), dlat)
+            if d <= self.__max_range:
+                return d
+        elif self.mode == "enu":
+            (e, n, inside) = self.__enu(lat, lon)
+            if inside:
+                return math.hypot(e, n)
+        return self.__haversine(lat, lon)
+
+    def bearing(self, lat: float, lon: float) -> float:
+        """Return bearing in degrees to a coordinate
+        """
+        if self.mode == "equirectangular":
+            dlat = math.radians(lat) - self.__rlat
+            dlon = math.radians((lon - self.lon + 180) % 360 - 180)
+            if DISTANCE_RADIUS * math.hypot(dlon * (self.__cos_lat - self.__sin_lat * dlat / 2), dlat) <= self.__max_range:
+                # bearing() with the trig of the target's latitude to first order
+                x = dlon * (self.__cos_lat - self.__sin_lat * dlat)
+                y = dlat + self.__sin_lat * self.__cos_lat * dlon * dlon / 2
+                return math.degrees(math.atan2(x, y)) % 360
+        elif self.mode == "enu":
+            (e, n, inside) = self.__enu(lat, lon)
+            if inside:
+                return math.degrees(math.atan2(e, n)) % 360
+        return bearing(self.lat, self.lon, lat, lon)
+
+    def distanceArray(self, lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+        """Array version of distance()
+        """
+        d = coordinate_distance_array(self.lat, self.lon, lat, lon) if self.mode == "haversine" else None
+        if self.mode == "equirectangular":
+            dlat = np.radians(lat) - self.__rlat
+            dlon = np.radians((np.asarray(lon) - self.lon + 180) % 360 - 180)
+            d = DISTANCE_RADIUS * np.hypot(dlon * (self.__cos_lat - self.__sin_lat * dlat / 2), dlat)
+            outside = d > self.__max_range
+        elif self.mode == "enu":
+            rlat = np.radians(lat)
+            dlon = np.radians(np.asarray(lon) - self.lon)
+            (sin_lat, cos_lat, cos_dlon) = (np.sin(rlat), np.cos(rlat), np.cos(dlon))
+            d = DISTANCE_RADIUS * np.hypot(cos_lat * np.sin(dlon), self.__cos_lat * sin_lat - self.__sin_lat * cos_lat * cos_dlon)
+            outside = self.__sin_lat * sin_lat + self.__cos_lat * cos_lat * cos_dlon < self.__cos_max_angle
+        if self.mode != "haversine" and np.any(outside):
+            d[outside] = coordinate_distance_array(self.lat, self.lon, np.asarray(lat)[outside], np.asarray(lon)[outside])
+        return d
+
+    def __enu(self, lat: float, lon: float) -> Tuple[float, float, bool]:
+        """Project a coordinate on the observer's local east/north plane"""
+        rlat = math.radians(lat)
+        dlon = math.radians(lon - self.lon)
+        (sin_lat, cos_lat) = (math.sin(rlat), math.cos(rlat))
+        cos_dlon = math.cos(dlon)
+        e = DISTANCE_RADIUS * cos_lat * math.sin(dlon)
+        n = DISTANCE_RADIUS * (self.__cos_lat * sin_lat - self.__sin_lat * cos_lat * cos_dlon)
+        return (e, n, self.__sin_lat * sin_lat + self.__cos_lat * cos_lat * cos_dlon >= self.__cos_max_angle)
+
+    def __haversine(self, lat: float, lon: float) -> float:
+        """coordinate_distance with the observer's cosine computed once"""
+        dLat = deg2rad(lat-self.lat)
+        dLon = deg2rad(lon-self.lon)
+        a = math.sin(dLat/2) * math.sin(dLat/2) + self.__cos_lat * math.cos(deg2rad(lat)) * math.sin(dLon/2) * math.sin(dLon/2)
+        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+        return DISTANCE_RADIUS * c
+
+
+def __enu_motion(my_lat, my_lon, lat, lon, speed_kts, heading):
+    """Position and velocity of aircraft in the observer's local east/north plane,
+    works on floats and arrays alike"""
+    (rlat0, rlon0) = (np.radians(my_lat), np.radians(my_lon))
+    (rlat, rlon) = (np.radians(lat), np.radians(lon))
+    rhdg = np.radians(heading)
+    dlon = rlon - rlon0
+    (slat0, clat0) = (np.sin(rlat0), np.cos(rlat0))
+    (slat, clat) = (np.sin(rlat), np.cos(rlat))
+    (sdlon, cdlon) = (np.sin(dlon), np.cos(dlon))
+    # Aircraft position projected on the observer's east and north axes
+    e = DISTANCE_RADIUS * clat * sdlon
+    n = DISTANCE_RADIUS * (clat0 * slat - slat0 * clat * cdlon)
+    # The aircraft's own north and east axes projected the same way
+    north_e = -slat * sdlon
+    north_n = clat0 * clat + slat0 * slat * cdlon
+    east_e = cdlon
+    east_n = slat0 * sdlon
+    # calc_travel2 travels on a slightly larger earth than coordinate_distance measures on
+    speed = 0.514444 * np.asarray(speed_kts, dtype=np.float64) * DISTANCE_RADIUS / TRAVEL_RADIUS
+    ve = speed * (np.sin(rhdg) * east_e + np.cos(rhdg) * north_e)
+    vn = speed * (np.sin(rhdg) * east_n + np.cos(rhdg) * north_n)
+    return (e, n, ve, vn)
+
+
+def find_time_min_distance(my_lat: float, my_lon: float, lat: float, lon: float, speed_kts: float, heading: float, max_time_s: float = CPA_HORIZON, refine: bool = False) -> tuple[float|None, float|None]:
     """Find minimum distance and how long until the aircraft reaches that distance
 
+    The closest point of approach is computed in closed form in the observer's
+    local tangent plane, which is accurate to a few meters within 100 km.
+
     Args:
         my_lat (float): Latitude of receiver
         my_lon (float): Longitude of receiver
@@ -207,10 +455,79 @@ def find_time_min_distance(my_lat: float, my_lon: float, lat: float, lon: float,
         lon (float): Longitude of aircraft
         speed_kts (float): Aircraft speed in knots
         heading (float): Aircraft heading in degrees
+        max_time_s (float): Look this many seconds ahead, None for no limit (default CPA_HORIZON)
+        refine (bool): Refine the result along the great circle track of calc_travel2 (default False)
 
     Returns:
         tuple[float|None, float|None]: Time and min distance or (None, None) if plane is moving away
     """
+    (e, n, ve, vn) = __enu_motion(my_lat, my_lon, lat, lon, speed_kts, heading)
+    v2 = ve * ve + vn * vn
+    if v2 == 0:
+        return (None, None)
+    min_time = -(e * ve + n * vn) / v2
+    if max_time_s is not None:
+        min_time = min(min_time, max_time_s)
+    if round(min_time) <= 0:
+        return (None, None)
+
+    if refine:
+        # Golden section search on the real track around the closed form result
+        distance = lambda t: coordinate_distance(my_lat, my_lon, *calc_travel2(lat, lon, t, speed_kts, heading))
+        width = 5 + 0.05 * min_time
+        (a, b) = (max(0.0, min_time - width), min_time + width)
+        if max_time_s is not None:
+            b = min(b, max_time_s)
+        g = (math.sqrt(5) - 1) / 2
+        (c, d) = (b - g * (b - a), a + g * (b - a))
+        (fc, fd) = (distance(c), distance(d))
+        while b - a > 0.01:
+            if fc < fd:
+                (b, d, fd) = (d, c, fc)
+                c = b - g * (b - a)
+                fc = distance(c)
+            else:
+                (a, c, fc) = (c, d, fd)
+                d = a + g * (b - a)
+                fd = distance(d)
+        min_time = (a + b) / 2
+        return (round(min_time), distance(min_time))
+
+    min_distance = math.hypot(float(e + ve * min_time), float(n + vn * min_time))
+    return (round(min_time), min_distance)
+
+
+def find_time_min_distance_array(my_lat: float, my_lon: float, lat: np.ndarray, lon: np.ndarray, speed_kts: np.ndarray, heading: np.ndarray, max_time_s: float = CPA_HORIZON) -> Tuple[np.ndarray, np.ndarray]:
+    """Array version of find_time_min_distance, for a whole fleet at once
+
+    Args:
+        my_lat (float): Latitude of receiver
+        my_lon (float): Longitude of receiver
+        lat (np.ndarray): Latitudes of aircraft
+        lon (np.ndarray): Longitudes of aircraft
+        speed_kts (np.ndarray): Aircraft speeds in knots
+        heading (np.ndarray): Aircraft headings in degrees
+        max_time_s (float): Look this many seconds ahead, None for no limit (default CPA_HORIZON)
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Times (rounded) and min distances, NaN for planes moving away
+    """
+    (e, n, ve, vn) = __enu_motion(my_lat, my_lon, lat, lon, speed_kts, heading)
+    v2 = ve * ve + vn * vn
+    with np.errstate(divide='ignore', invalid='ignore'):
+        min_time = -(e * ve + n * vn) / v2
+    if max_time_s is not None:
+        min_time = np.minimum(min_time, max_time_s)
+    min_distance = np.hypot(e + ve * min_time, n + vn * min_time)
+    min_time = np.round(min_time)
+    away = ~(min_time > 0)
+    min_time[away] = np.nan
+    min_distance[away] = np.nan
+    return (min_time, min_distance)
+
+
+def _find_time_min_distance_brute(my_lat: float, my_lon: float, lat: float, lon: float, speed_kts: float, heading: float) -> tuple[float|None, float|None]:
+    """The original brute force search over 60 seconds in 0.5 second steps, kept to check the closed form against"""
     min_distance: float = 1e9
     min_time: float = 0
     time_step_s: float = 0.5
@@ -223,7 +540,6 @@ def find_time_min_distance(my_lat: float, my_lon: float, lat: float, lon: float,
         if distance < min_distance:
             min_distance = distance
             min_time = time
-        #print(f"[{time:.2f}] : {distance:.3f}")
         time += time_step_s
 
     if initial_distance < min_distance or min_time == 0:
@@ -254,4 +570,70 @@ if __name__ == "__main__":
     if min_time is None or min_distance is None:
         print("Plane is moving away")
     else:
-        print(f"Min distance after {round(min_time):d}s: {min_distance:.1f} meters")
\ No newline at end of file
+        print(f"Min distance after {round(min_time):d}s: {min_distance:.1f} meters")
+    # The array versions match the scalar ones
+    rng = np.random.default_rng(1)
+    lat1 = rng.uniform(-89, 89, 1000)
+    lon1 = rng.uniform(-180, 180, 1000)
+    lat2 = rng.uniform(-89, 89, 1000)
+    lon2 = rng.uniform(-180, 180, 1000)
+    speed = rng.uniform(0, 600, 1000)
+    duration = rng.uniform(0, 600, 1000)
+    assert np.allclose(coordinate_distance_array(lat1, lon1, lat2, lon2), [coordinate_distance(*x) for x in zip(lat1, lon1, lat2, lon2)], rtol=0, atol=1e-6)
+    assert np.allclose(bearing_array(lat1, lon1, lat2, lon2), [bearing(*x) for x in zip(lat1, lon1, lat2, lon2)], rtol=0, atol=1e-9)
+    (new_lat, new_lon) = calc_travel2_array(lat1, lon1, duration, speed, lon2 + 180)
+    expected = np.array([calc_travel2(*x) for x in zip(lat1, lon1, duration, speed, lon2 + 180)])
+    assert np.allclose(new_lat, expected[:, 0], rtol=0, atol=1e-9) and np.allclose(new_lon, expected[:, 1], rtol=0, atol=1e-9)
+    print("Array versions match")
+
+    # The closed form CPA matches the brute force search, for aircraft within 100 km
+    rng = np.random.default_rng(2)
+    (my_lat, my_lon) = (55.6, 13.0)
+    worst_time = worst_distance = worst_refined = 0
+    fleet = []
+    for _ in range(2000):
+        (lat, lon) = calc_travel2(my_lat, my_lon, rng.uniform(0, 100000) / 0.514444, 1, rng.uniform(0, 360))
+        (speed, heading) = (rng.uniform(100, 500), rng.uniform(0, 360))
+        fleet.append((lat, lon, speed, heading))
+        (brute_time, brute_distance) = _find_time_min_distance_brute(my_lat, my_lon, lat, lon, speed, heading)
+        (cpa_time, cpa_distance) = find_time_min_distance(my_lat, my_lon, lat, lon, speed, heading)
+        (refined_time, refined_distance) = find_time_min_distance(my_lat, my_lon, lat, lon, speed, heading, refine=True)
+        if brute_time is None or cpa_time is None or not 1 < brute_time < 59:
+            # Moving away or CPA at the edges, where rounding decides
+            continue
+        worst_time = max(worst_time, abs(cpa_time - brute_time))
+        # The brute force result is at most 0.5 s of travel off the true minimum
+        worst_distance = max(worst_distance, cpa_distance - brute_distance)
+        worst_refined = max(worst_refined, refined_distance - brute_distance)
+    print(f"CPA vs brute force: time off by at most {worst_time:.0f}s, distance {worst_distance:.1f}m ({worst_refined:.2f}m refined)")
+    assert worst_time <= 1 and worst_distance < 5 and worst_refined < 0.01
+    (times, distances) = find_time_min_distance_array(my_lat, my_lon, *np.array(fleet).T)
+    for ((lat, lon, speed, heading), t, d) in zip(fleet, times, distances):
+        (cpa_time, cpa_distance) = find_time_min_distance(my_lat, my_lon, lat, lon, speed, heading)
+        assert (cpa_time is None and np.isnan(t)) or (cpa_time == t and abs(cpa_distance - d) < 1e-6)
+    print("Batched CPA matches")
+
+    # The observer modes stay within their error bounds
+    rng = np.random.default_rng(3)
+    for my_lat in (0, 35, 55, 70):
+        for max_range in (10000, 50000, 100000):
+            lat = np.empty(20000)
+            lon = np.empty(20000)
+            for i in range(len(lat)):
+                (lat[i], lon[i]) = calc_travel2(my_lat, 13.0, rng.uniform(0, max_range) / 0.514444 * TRAVEL_RADIUS / DISTANCE_RADIUS, 1, rng.uniform(0, 360))
+            expected = coordinate_distance_array(my_lat, 13.0, lat, lon)
+            expected_bearing = bearing_array(my_lat, 13.0, lat, lon)
+            for mode in GEODESY_MODES:
+                observer = Observer(my_lat, 13.0, mode, max_range * 1.01)
+                bound = geodesy_error_bound(mode, my_lat, max_range) + 1e-6
+                distances = observer.distanceArray(lat, lon)
+                assert np.abs(distances - expected).max() <= bound, "%s off by %f m at %d km" % (mode, np.abs(distances - expected).max(), max_range / 1000)
+                for i in range(0, len(lat), 50):
+                    assert abs(observer.distance(lat[i], lon[i]) - distances[i]) < 1e-6
+                    assert abs((observer.bearing(lat[i], lon[i]) - expected_bearing[i] + 180) % 360 - 180) < 0.05
+            # Far away targets fall back to haversine
+            for mode in GEODESY_MODES:
+                observer = Observer(my_lat, 13.0, mode, max_range)
+                assert abs(observer.distance(-my_lat, 193.0) - coordinate_distance(my_lat, 13.0, -my_lat, 193.0)) < 1e-6
+                assert abs(observer.distanceArray(np.array([-my_lat]), np.array([193.0]))[0] - coordinate_distance(my_lat, 13.0, -my_lat, 193.0)) < 1e-6
+    print("Geodesy modes within bounds: %s" % (", ".join("%s %.2fm" % (mode, geodesy_error_bound(mode, 55, 50000)) for mode in GEODESY_MODES)))